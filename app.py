@@ -2,13 +2,16 @@
 NASA Research Assistant - Production Web Interface
 A RAG system for querying NASA research documents using Gemini 2.0 and LlamaParse
 """
+import os
+import multiprocessing
 import streamlit as st
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Import our core modules
-from query_engine import QueryEngine
+from query_engine import QueryEngine, clear_embedding_cache
 from document_ingestion import DocumentIngestion
-from multimodal_processor import process_pdf_multimodal
+from multimodal_processor import process_pdfs_multimodal
 import config
 
 # Import utility functions (keeps the code clean!)
@@ -21,12 +24,17 @@ from utils import (
     initialize_session_state,
     clear_chat_history,
     add_message,
-    get_file_hash,
-    load_document_metadata,
-    save_document_metadata,
+    stream_to_disk_and_hash,
+    get_file_quick_key,
     add_document_to_metadata,
+    metadata_batch,
+    get_document_url_map,
+    is_hash_indexed,
     display_chat_history,
     get_chat_input,
+    response_lacks_info,
+    available_images,
+    image_caption,
 )
 
 
@@ -46,10 +54,8 @@ def load_query_engine(_model_index=0):
         _model_index: Starting model index (underscore prevents hashing for cache key)
     """
     try:
-        engine = QueryEngine(starting_model_index=_model_index)
-        if not engine or not engine.query_engine:
-            return None
-        return engine
+        # Cheap - models and the index are loaded lazily on first query (or warmup)
+        return QueryEngine(starting_model_index=_model_index)
     except FileNotFoundError:
         return None
     except Exception as e:
@@ -59,13 +65,108 @@ def load_query_engine(_model_index=0):
 
 def reload_query_engine():
     """Force reload of query engine after ingestion"""
-    st.cache_resource.clear()
+    # Only the engine - keep the ingestion object and worker pools alive
+    load_query_engine.clear()
+    clear_embedding_cache()
     # Reset model index on reload
     if 'current_model_index' in st.session_state:
         return load_query_engine(st.session_state.current_model_index)
     return load_query_engine()
 
 
+@st.cache_resource
+def get_ingestion():
+    """Shared document ingestion system (models and Pinecone connection are set up once)"""
+    return DocumentIngestion()
+
+
+@st.cache_resource
+def get_ingest_executor():
+    """Background worker pool for document ingestion (cached across reruns)"""
+    # One job at a time - jobs share one DocumentIngestion, and two overlapping
+    # create_index runs would both see (and embed) the same new files
+    return ThreadPoolExecutor(max_workers=1)
+
+
+@st.cache_resource
+def get_pdf_pool():
+    """Worker processes for CPU-bound PDF image extraction (cached across reruns)"""
+    # Spawn, not fork - forking the Streamlit server (and its threads) isn't safe
+    return ProcessPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 2) // 2),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _ingest_job(uploads, progress, pdf_pool, ingestion):
+    """Extract images and index a batch of uploaded documents in a background thread
+    
+    Runs outside the Streamlit script thread, so it must not touch st.session_state
+    or render anything. Progress is reported by updating the plain `progress` dict instead.
+    
+    Documents are only recorded in the metadata once indexing succeeded - a
+    failed job leaves them unrecorded, so uploading them again retries.
+    
+    Args:
+        uploads: List of (file_path, file_hash, url, quick_key) tuples
+        progress: Shared dict with "done" and "total" counts
+        pdf_pool: Process pool for image extraction (fetched in the script thread)
+        ingestion: Shared DocumentIngestion (fetched in the script thread)
+    
+    Returns:
+        The filenames that were indexed
+    """
+    paths = [Path(file_path) for file_path, _, _, _ in uploads]
+    
+    # Extract images from every PDF at once, one worker process per file
+    if config.EXTRACT_IMAGES:
+        pdf_paths = [str(path) for path in paths if path.suffix.lower() == '.pdf']
+        process_pdfs_multimodal(pdf_paths, executor=pdf_pool)
+    
+    # Index documents (once for the whole batch)
+    def on_progress(done, total):
+        progress["done"], progress["total"] = done, total
+    
+    if ingestion.create_index(force_new=True, progress_callback=on_progress) is None:
+        raise RuntimeError("No index was created - check the server log for details")
+    
+    # Save metadata with URL (using our utility function!) - one file write for the batch
+    with metadata_batch():
+        for file_path, file_hash, url_input, quick_key in uploads:
+            add_document_to_metadata(file_hash, Path(file_path).name, url_input, quick_key=quick_key)
+    
+    return [path.name for path in paths]
+
+
+def render_ingest_status():
+    """Show the state of background ingestion jobs, reloading the engine when one finishes"""
+    futures = st.session_state.ingest_futures
+    progress = st.session_state.ingest_progress
+    
+    for job_key, future in list(futures.items()):
+        if not future.done():
+            job = progress[job_key]
+            if job["total"]:
+                st.info(f"Creating embeddings for {job['name']}... {job['done']}/{job['total']}")
+            else:
+                st.info(f"Processing {job['name']}...")
+            continue
+        
+        del futures[job_key]
+        del progress[job_key]
+        error = future.exception()
+        if error:
+            st.error(f"Indexing failed: {str(error)}")
+        else:
+            st.success(f"✅ Successfully indexed {', '.join(future.result())}")
+            # Only the query engine needs reloading - keep the worker pool alive
+            load_query_engine.clear()
+    
+    if futures:
+        if st.button("Refresh status", use_container_width=True):
+            st.rerun()
+
+
 # Session state initialization moved to utils/session_manager.py
 
 
@@ -94,26 +195,27 @@ def main():
         st.markdown("### 📁 Upload Documents")
         
         
-        uploaded_file = st.file_uploader(
-            "Select PDF file",
+        uploaded_files = st.file_uploader(
+            "Select PDF files",
             type=["pdf"],
-            accept_multiple_files=False,
+            accept_multiple_files=True,
             label_visibility="collapsed",
             help="Limit 200MB per file • PDF"
         )
         
-        # URL input for the uploaded file
-        if uploaded_file:
-            st.caption(f"📄 {uploaded_file.name}")
-            
-            url = st.text_input(
-                f"URL for {uploaded_file.name}",
-                key=f"url_{uploaded_file.name}",
-                placeholder="https://...",
-                label_visibility="collapsed"
-            )
-            if url:
-                st.session_state.doc_urls[uploaded_file.name] = url
+        # URL input for each uploaded file
+        if uploaded_files:
+            for uploaded_file in uploaded_files:
+                st.caption(f"📄 {uploaded_file.name}")
+                
+                url = st.text_input(
+                    f"URL for {uploaded_file.name}",
+                    key=f"url_{uploaded_file.name}",
+                    placeholder="https://...",
+                    label_visibility="collapsed"
+                )
+                if url:
+                    st.session_state.doc_urls[uploaded_file.name] = url
             
             # Ingest button
             ingest_button = st.button("Process & Index", type="primary", use_container_width=True)
@@ -123,64 +225,64 @@ def main():
                 st.rerun()
             
             if ingest_button:
-                # Validate URL
-                url_input = st.session_state.doc_urls.get(uploaded_file.name, "").strip()
-                if not validate_url(url_input):
-                    st.error("Please provide a valid URL")
+                # Validate URLs
+                url_inputs = {
+                    f.name: st.session_state.doc_urls.get(f.name, "").strip() for f in uploaded_files
+                }
+                missing = [name for name, url_input in url_inputs.items() if not validate_url(url_input)]
+                if missing:
+                    st.error(f"Please provide a valid URL for: {', '.join(missing)}")
                     st.caption("URL must start with http:// or https://")
                 else:
-                    # Progress container
-                    status_container = st.empty()
-                    
                     try:
-                        with st.spinner("Processing..."):
-                            metadata = load_document_metadata()
+                        in_progress = {h for job_key in st.session_state.ingest_futures for h in job_key}
+                        uploads = []
+                        
+                        for uploaded_file in uploaded_files:
+                            # Stream the upload to a temp file, hashing as we go to detect duplicates
+                            # (never overwrites an existing copy of the same document)
+                            file_path = Path(config.DATA_DIR) / uploaded_file.name
+                            temp_path = file_path.with_name(file_path.name + ".part")
+                            quick_key = get_file_quick_key(uploaded_file)  # Lets new files skip the indexed lookups
+                            file_hash = stream_to_disk_and_hash(uploaded_file, temp_path)
                             
-                            status_container.info(f"Processing {uploaded_file.name}...")
+                            if is_hash_indexed(file_hash, temp_path, quick_key=quick_key):
+                                temp_path.unlink(missing_ok=True)
+                                st.warning(f"⚠️ {uploaded_file.name} already indexed")
+                            elif file_hash in in_progress:
+                                temp_path.unlink(missing_ok=True)
+                                st.info(f"{uploaded_file.name} is already being indexed")
+                            else:
+                                # Move the finished file into the data directory
+                                temp_path.replace(file_path)
+                                in_progress.add(file_hash)
+                                uploads.append((str(file_path), file_hash, url_inputs[uploaded_file.name], quick_key))
+                        
+                        if uploads:
+                            # Models load on the first ingest only (cached afterwards)
+                            with st.spinner("Loading models..."):
+                                ingestion = get_ingestion()
                             
-                            # Calculate file hash to detect duplicates
-                            file_content = uploaded_file.read()
-                            file_hash = get_file_hash(file_content)
+                            # Hand the slow parse + embed work to a background worker
+                            job_key = tuple(file_hash for _, file_hash, _, _ in uploads)
+                            names = ", ".join(Path(file_path).name for file_path, _, _, _ in uploads)
+                            progress = {"name": names, "done": 0, "total": 0}
+                            future = get_ingest_executor().submit(
+                                _ingest_job, uploads, progress, get_pdf_pool(), ingestion
+                            )
+                            st.session_state.ingest_futures[job_key] = future
+                            st.session_state.ingest_progress[job_key] = progress
                             
-                            if file_hash in metadata:
-                                status_container.warning(f"⚠️ {uploaded_file.name} already indexed")
-                            else:
-                                # Save file to data directory
-                                file_path = Path(config.DATA_DIR) / uploaded_file.name
-                                with open(file_path, 'wb') as f:
-                                    f.write(file_content)
-                                
-                                # Save metadata with URL (using our utility function!)
-                                add_document_to_metadata(file_hash, uploaded_file.name, url_input)
-                                
-                                # Process PDFs with multimodal extraction
-                                if config.EXTRACT_IMAGES and file_path.suffix.lower() == '.pdf':
-                                    status_container.info("Extracting images...")
-                                    try:
-                                        multimodal_data = process_pdf_multimodal(str(file_path))
-                                        num_images = len(multimodal_data.get('images', []))
-                                        if num_images > 0:
-                                            status_container.success(f"Extracted {num_images} images")
-                                    except Exception as e:
-                                        pass
-                                
-                                # Index documents
-                                status_container.info("Creating embeddings...")
-                                try:
-                                    ingestion = DocumentIngestion()
-                                    ingestion.create_index(force_new=True)
-                                    status_container.success(f"✅ Successfully indexed {uploaded_file.name}")
-                                    
-                                    # Clear URLs and reload
-                                    st.session_state.doc_urls = {}
-                                    st.cache_resource.clear()
-                                    st.rerun()
-                                except Exception as e:
-                                    status_container.error(f"Indexing failed: {str(e)}")
+                            # Clear URLs and rerun to show the job status
+                            st.session_state.doc_urls = {}
+                            st.rerun()
                     
                     except Exception as e:
                         st.error(f"Processing error: {str(e)}")
         
+        # Status of any documents still being indexed
+        render_ingest_status()
+        
         # Add spacing before footer button
         st.markdown("<div style='padding-bottom: 40px;'></div>", unsafe_allow_html=True)
     
@@ -210,8 +312,8 @@ def main():
         st.error(f"Failed to load: {str(e)}")
         return
     
-    # Check engine status
-    if not engine or not engine.query_engine:
+    # Check engine status (emptiness is only known once the index has been loaded)
+    if not engine or (engine.is_ready and not engine.query_engine):
         st.warning("⚠️ No documents indexed yet")
         st.info("📤 Upload PDF documents using the sidebar to get started")
         return
@@ -219,6 +321,16 @@ def main():
     # Main content area
     st.divider()
     
+    # Let users pre-pay the model load instead of waiting on their first question
+    if not engine.is_ready:
+        if st.button("⚡ Warm up model", help="Load the embedding model and index now"):
+            try:
+                with st.spinner("Initializing model…"):
+                    engine.warmup()
+                st.rerun()
+            except Exception as e:
+                st.error(f"Failed to load: {str(e)}")
+    
     # Display chat history (now handled by our utility function!)
     display_chat_history()
     
@@ -243,70 +355,61 @@ def main():
                 def on_model_switch(new_model_index):
                     st.session_state.current_model_index = new_model_index
                     # Clear cache to reload with new model
-                    st.cache_resource.clear()
+                    load_query_engine.clear()
                 
                 # Track if model switched during this query
                 initial_model = engine.current_model
                 
-                with st.spinner("Searching..."):
-                    result = engine.query(prompt, on_model_switch=on_model_switch)
+                with st.spinner("Searching..." if engine.is_ready else "Initializing model…"):
+                    result = engine.query_stream(prompt, on_model_switch=on_model_switch)
                 
                 # Silently handle model switches without showing notifications
                 
-                # Display response
-                st.markdown(result["response"])
+                # Stream the response into the chat bubble as it's generated
+                placeholder = st.empty()
+                full_response = ""
+                for delta in result["response_gen"]:
+                    full_response += delta
+                    placeholder.markdown(full_response + "▌")
+                placeholder.markdown(full_response)
                 
                 # Display relevant images directly in the response
                 if result.get("images"):
                     st.markdown("")  # Small spacing
-                    for img_data in result["images"]:
+                    for img_data in available_images(result["images"]):
                         try:
-                            img_path = Path(img_data["path"])
-                            if img_path.exists():
-                                # Display image prominently
-                                st.image(str(img_path), use_column_width=True)
-                                # Show compact metadata below image
-                                caption_parts = []
-                                if "source_pdf" in img_data:
-                                    caption_parts.append(f"📄 {img_data['source_pdf']}")
-                                if "page" in img_data:
-                                    caption_parts.append(f"Page {img_data['page']}")
-                                if caption_parts:
-                                    st.caption(" • ".join(caption_parts))
-                                # Show description if available
-                                if "description" in img_data and img_data["description"]:
-                                    with st.expander("📋 Image details"):
-                                        st.write(img_data["description"])
-                                st.markdown("")  # Spacing between images
+                            # Display image prominently
+                            st.image(img_data["path"], use_column_width=True)
+                            # Show compact metadata below image
+                            caption = image_caption(img_data)
+                            if caption:
+                                st.caption(caption)
+                            # Show description if available
+                            if "description" in img_data and img_data["description"]:
+                                with st.expander("📋 Image details"):
+                                    st.write(img_data["description"])
+                            st.markdown("")  # Spacing between images
                         except Exception as e:
                             pass  # Silently skip images that can't be displayed
                 
                 # Display sources
                 if result["sources"]:
                     relevant_sources = result["sources"]
-                    no_info_available = any(phrase in result["response"].lower() for phrase in 
-                        ["don't have specific information", "don't have information", 
-                         "no information available", "not available in", "cannot find"])
+                    no_info_available = response_lacks_info(full_response)
                     
                     if relevant_sources and not no_info_available:
                         st.markdown("---")
                         st.caption("**📚 Sources:**")
-                        metadata = load_document_metadata()
+                        url_map = get_document_url_map()
                         
-                        # Get unique sources
-                        unique_sources = {}
-                        for source in relevant_sources:
-                            filename = source['metadata'].get('file_name', 'Unknown')
-                            if filename not in unique_sources:
-                                unique_sources[filename] = True
+                        # Get unique sources in one pass (order matters - it matches the [n] citations)
+                        unique_sources = dict.fromkeys(
+                            source['metadata'].get('file_name', 'Unknown') for source in relevant_sources
+                        )
                         
                         # Display sources with numbered citations like [1], [2], etc.
-                        for idx, filename in enumerate(unique_sources.keys(), 1):
-                            doc_url = None
-                            for hash_val, meta in metadata.items():
-                                if meta.get('filename') == filename:
-                                    doc_url = meta.get('url')
-                                    break
+                        for idx, filename in enumerate(unique_sources, 1):
+                            doc_url = url_map.get(filename)
                             
                             # Display with numbered citation and clickable link (just the URL)
                             if doc_url:
@@ -317,7 +420,7 @@ def main():
                 # Add assistant message to chat history (using our utility function!)
                 add_message(
                     "assistant", 
-                    result["response"],
+                    full_response,
                     sources=result["sources"],
                     images=result.get("images", [])
                 )
@@ -2,23 +2,42 @@
 Configuration file for NASA RAG System
 """
 import os
+import threading
+import importlib
+import multiprocessing
+from functools import lru_cache
+from types import MappingProxyType
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
-
-# Try to import streamlit for cloud deployment
-try:
-    import streamlit as st
-    # On Streamlit Cloud, use st.secrets
-    GOOGLE_API_KEY = st.secrets.get("GOOGLE_API_KEY", os.getenv("GOOGLE_API_KEY"))
-    LLAMA_CLOUD_API_KEY = st.secrets.get("LLAMA_CLOUD_API_KEY", os.getenv("LLAMA_CLOUD_API_KEY"))
-    PINECONE_API_KEY = st.secrets.get("PINECONE_API_KEY", os.getenv("PINECONE_API_KEY"))
-except (ImportError, FileNotFoundError):
-    # Local development, use .env file
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    LLAMA_CLOUD_API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
-    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+SECRET_KEYS = ("GOOGLE_API_KEY", "LLAMA_CLOUD_API_KEY", "PINECONE_API_KEY")
+
+# Local caches (model exports, probed embedding sizes) - kept out of the project and data/
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nasa_rag")
+
+
+# Load environment variables (once - module globals survive importlib.reload)
+if not globals().get("_DOTENV_LOADED"):
+    load_dotenv()
+    _DOTENV_LOADED = True
+
+
+@lru_cache(maxsize=None)
+def _secrets():
+    """Look up every API key once (read-only dict)"""
+    # Try to import streamlit for cloud deployment
+    try:
+        import streamlit as st
+        # On Streamlit Cloud, use st.secrets
+        secrets = {key: st.secrets.get(key, os.getenv(key)) for key in SECRET_KEYS}
+    except (ImportError, FileNotFoundError):
+        # Local development, use .env file
+        secrets = {key: os.getenv(key) for key in SECRET_KEYS}
+    return MappingProxyType(secrets)
+
+
+GOOGLE_API_KEY = _secrets()["GOOGLE_API_KEY"]
+LLAMA_CLOUD_API_KEY = _secrets()["LLAMA_CLOUD_API_KEY"]
+PINECONE_API_KEY = _secrets()["PINECONE_API_KEY"]
 
 # Model Configuration
 GEMINI_MODEL = "gemini-2.5-pro"  # Primary model: Gemini 2.0 Flash (fast, experimental)
@@ -31,6 +50,20 @@ FALLBACK_MODELS = [
 EMBEDDING_MODEL = "models/embedding-001"  # Google embedding (has quota limits)
 USE_LOCAL_EMBEDDINGS = True  # Set to True to use free local HuggingFace embeddings
 LOCAL_EMBEDDING_MODEL = "dunzhang/stella_en_400M_v5"  # Stella v5: SOTA embeddings (Jan 2025)
+# On CPU-only hosts, optionally swap Stella for a much smaller model.
+# Its dimension differs (384), so switching recreates the Pinecone index - re-index afterwards.
+USE_CPU_FALLBACK_EMBEDDINGS = False
+CPU_FALLBACK_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+EMBEDDING_DIMENSIONS = {  # Known output sizes - skips the probe embedding on startup
+    "dunzhang/stella_en_400M_v5": 1024,
+    "BAAI/bge-small-en-v1.5": 384,
+    "models/embedding-001": 768,
+}
+EMBED_BATCH_SIZE = 32  # Chunks per embedding call - CPU forward pass or Gemini request (library default is 10)
+EMBED_BATCH_SIZE_GPU = 128  # Bigger batches keep the GPU busy
+QUANTIZE_EMBEDDINGS = False  # int8 local embedder on CPU: ONNX export (needs optimum[onnxruntime]), else torch dynamic quantization
+QUANTIZE_EMBEDDINGS_TARGET = "avx512_vnni"  # Quantization preset: "avx512_vnni", "avx512", "avx2" or "arm64"
+EMBEDDING_COMPILE = False  # torch.compile the local embedder (slow first encode, faster after)
 
 # Cloud Storage Configuration (Pinecone)
 PINECONE_INDEX_NAME = "nasa-rag-index"  # Your Pinecone index name
@@ -40,18 +73,38 @@ PINECONE_ENVIRONMENT = "us-east-1"  # Your Pinecone environment/region
 DATA_DIR = "./data"
 
 # RAG Configuration
-CHUNK_SIZE = 1024
-CHUNK_OVERLAP = 200
+CHUNK_SIZE = 480  # Tokens per chunk - fits Stella's 512-token window with room for metadata
+CHUNK_OVERLAP = 48  # ~10% overlap (less duplicated embedding and storage)
 TOP_K_RESULTS = 20  # Retrieve more, then filter by relevance
 RELEVANCE_THRESHOLD = 0.3  # Only show sources with >0.3 relevance (0-1 scale) - lowered to capture more content
+MAX_QUESTION_LENGTH = 4000  # Longer input gets a canned reply instead of a Gemini call
+RESPONSE_CACHE_SIZE = 256  # Recent answers kept for near-duplicate questions
+RESPONSE_CACHE_THRESHOLD = 0.95  # Cosine similarity needed to reuse a cached answer
+RESPONSE_CACHE_FILE = "./data/.response_cache.npz"  # Persisted answers
+INDEX_STAMP_FILE = "./data/.index_stamp"  # Touched whenever documents are indexed - cached answers older than it are dropped
+INDEXED_HASHES_FILE = "./data/.indexed_hashes.json"  # sha256 of files whose vectors were all upserted
+EMBEDDING_PARALLEL_BATCHES = 4  # Embedding batches sent concurrently during indexing
+PINECONE_UPSERT_WORKERS = 4  # Threads upserting embedded batches while the next ones embed
+
+# Import the HuggingFace/torch stack in a background thread at startup so it's
+# resident by the time the embedding model loads (skipped in worker processes)
+WARM_IMPORTS = True
+WARM_IMPORT_MODULES = ["llama_index.embeddings.huggingface"]
 
 # PDF Parsing Configuration
 USE_LLAMA_PARSE = True  # Use LlamaParse for better PDF extraction (tables, images, etc.)
 LLAMA_PARSE_RESULT_TYPE = "markdown"  # "markdown" preserves table structure better than "text"
 LLAMA_PARSE_SPLIT_BY_PAGE = False  # Keep tables together, don't split by page
+LLAMA_PARSE_MAX_CONCURRENCY = 8  # PDFs uploaded to LlamaParse at the same time
+LLAMA_PARSE_CACHE_DIR = "./data/.llamaparse_cache"  # Parsed text per file hash (skips re-parsing unchanged PDFs)
 EXTRACT_IMAGES = False  # Extract images from PDFs for multimodal search
 IMAGE_EXTRACTION_DIR = "./data/images"  # Where to store extracted images
+MIN_IMAGE_SIZE = 150  # Skip images narrower or shorter than this (px) - icons, logos, glyphs
 DESCRIBE_IMAGES_WITH_AI = True  # Use Gemini Vision to describe images (slower, uses API quota)
+IMAGE_DESCRIPTION_BATCH_SIZE = 10  # Images sent in one Gemini Vision request
+IMAGE_DESCRIPTION_WORKERS = 8  # Description requests in flight per PDF
+IMAGE_DESCRIPTION_RPS = 1.0  # Max Gemini Vision requests per second (shared by every description thread)
+VISION_MAX_IMAGE_SIZE = 1024  # Images are downscaled to fit this box (px) before upload
 
 # System Prompt for NASA Chatbot
 SYSTEM_PROMPT = """You're Alexi, a helpful AI chatbot created at the NASA Space Challenge 2025 hackathon in Winnipeg! You have access to NASA research papers and love helping people explore space science.
@@ -95,3 +148,15 @@ os.makedirs(DATA_DIR, exist_ok=True)
 if EXTRACT_IMAGES:
     os.makedirs(IMAGE_EXTRACTION_DIR, exist_ok=True)
 
+
+def _warm_imports():
+    """Import heavy modules ahead of time (errors surface later, at the real import)"""
+    for module in WARM_IMPORT_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+
+
+if WARM_IMPORTS and USE_LOCAL_EMBEDDINGS and multiprocessing.current_process().name == "MainProcess":
+    threading.Thread(target=_warm_imports, name="warm-imports", daemon=True).start()
@@ -3,7 +3,14 @@ Document Ingestion Module for NASA RAG System
 Handles loading and indexing NASA documents
 """
 import os
+import json
+import asyncio
+import hashlib
 import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from pathlib import Path
 from typing import List
 
 # Suppress Google gRPC warnings
@@ -11,18 +18,22 @@ os.environ['GRPC_VERBOSITY'] = 'ERROR'
 os.environ['GLOG_minloglevel'] = '2'
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 from llama_index.core import (
+    Document,
     VectorStoreIndex,
     SimpleDirectoryReader,
     StorageContext,
     Settings
 )
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
 # Cloud storage imports
 try:
     from pinecone import Pinecone, ServerlessSpec
+    from pinecone.exceptions import NotFoundException, PineconeException
     from llama_index.vector_stores.pinecone import PineconeVectorStore
     PINECONE_AVAILABLE = True
 except ImportError:
@@ -37,13 +48,286 @@ except ImportError:
     print("⚠️  LlamaParse not installed. Install with: pip install llama-parse")
 
 try:
-    from multimodal_processor import process_pdf_multimodal
+    from multimodal_processor import process_pdfs_multimodal
     MULTIMODAL_AVAILABLE = True
 except ImportError:
     MULTIMODAL_AVAILABLE = False
     print("⚠️  Multimodal processor not available")
 
 import config
+from utils.rate_limit import is_quota_error
+from utils.document_manager import matches_recorded_document
+
+
+# File types picked up from the data directory
+SUPPORTED_EXTS = frozenset({".pdf", ".txt", ".docx", ".md"})
+
+# Set once the global LlamaIndex Settings (LLM, embedder, chunking) are configured
+_SETTINGS_READY = False
+
+
+# Model loads are slow and several threads (UI script, ingest jobs) may ask at once
+_EMBEDDER_LOCK = threading.Lock()
+
+
+def build_embed_model():
+    """Create the configured embedding model (local HuggingFace or Google)"""
+    if not config.USE_LOCAL_EMBEDDINGS:
+        return GeminiEmbedding(
+            model_name=config.EMBEDDING_MODEL,
+            api_key=config.GOOGLE_API_KEY,
+            embed_batch_size=config.EMBED_BATCH_SIZE
+        )
+    
+    try:
+        import torch
+        use_gpu = torch.cuda.is_available()
+    except ImportError:
+        use_gpu = False
+    
+    model_name = config.LOCAL_EMBEDDING_MODEL
+    if not use_gpu and config.USE_CPU_FALLBACK_EMBEDDINGS:
+        # A 400M model is slow on CPU - trade some quality for speed
+        model_name = config.CPU_FALLBACK_EMBEDDING_MODEL
+    
+    with _EMBEDDER_LOCK:
+        return _get_embedder(model_name, "cuda" if use_gpu else "cpu")
+
+
+@lru_cache(maxsize=1)
+def _get_embedder(model_name: str, device: str):
+    """Load a local embedding model once per process (shared by every engine and ingestion run)"""
+    import torch
+    
+    # fp16 on GPU uses the tensor cores and halves memory; keep fp32 on CPU
+    if device == "cuda":
+        device_kwargs = {
+            "device": "cuda",
+            "model_kwargs": {"torch_dtype": torch.float16},
+            "embed_batch_size": config.EMBED_BATCH_SIZE_GPU
+        }
+    else:
+        torch.set_num_threads(os.cpu_count() or 1)
+        device_kwargs = {"device": "cpu", "embed_batch_size": config.EMBED_BATCH_SIZE}
+    
+    # Stella model needs special config
+    stella_kwargs = {
+        "config_kwargs": {
+            "use_memory_efficient_attention": False,
+            "unpad_inputs": False
+        }
+    } if "stella" in model_name.lower() else {}
+    
+    if config.QUANTIZE_EMBEDDINGS and device == "cpu":
+        embed_model = _build_quantized_model(model_name, stella_kwargs)
+        if embed_model is not None:
+            return embed_model
+    
+    embed_model = _inference_embedding_class()(
+        model_name=model_name,
+        trust_remote_code=True,
+        **stella_kwargs,
+        **device_kwargs
+    )
+    embed_model._model.eval()
+    
+    # ONNX export unavailable - int8 the PyTorch Linear layers instead
+    if config.QUANTIZE_EMBEDDINGS and device == "cpu" and _quantize_local_model(embed_model):
+        return embed_model
+    
+    _optimize_local_model(embed_model)
+    return embed_model
+
+
+@lru_cache(maxsize=1)
+def _inference_embedding_class():
+    """HuggingFaceEmbedding that encodes under torch.inference_mode (no autograd bookkeeping)"""
+    # Imported here (torch + transformers take seconds) - config warms it up in the background
+    import torch
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    
+    class InferenceHuggingFaceEmbedding(HuggingFaceEmbedding):
+        def _embed(self, *args, **kwargs):
+            with torch.inference_mode():
+                return super()._embed(*args, **kwargs)
+    
+    return InferenceHuggingFaceEmbedding
+
+
+@lru_cache(maxsize=1)
+def get_pinecone_client():
+    """Shared Pinecone client (created once per process)"""
+    return Pinecone(api_key=config.PINECONE_API_KEY)
+
+
+# Set once the index has been seen - it isn't deleted behind our back, so later
+# engines (every Streamlit reload) skip the round-trip
+_INDEX_CONFIRMED = False
+
+
+def pinecone_index_exists(pc) -> bool:
+    """Check whether the configured Pinecone index exists"""
+    global _INDEX_CONFIRMED
+    if _INDEX_CONFIRMED:
+        return True
+    
+    # has_index is a single lookup; older clients have to list every index
+    if hasattr(pc, "has_index"):
+        exists = pc.has_index(config.PINECONE_INDEX_NAME)
+    else:
+        exists = config.PINECONE_INDEX_NAME in [idx.name for idx in pc.list_indexes()]
+    
+    _INDEX_CONFIRMED = exists
+    return exists
+
+
+def _file_sha256(path, chunk: int = 1 << 20) -> str:
+    """Hash a file's contents without reading it into memory all at once"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk_bytes := f.read(chunk):
+            hasher.update(chunk_bytes)
+    return hasher.hexdigest()
+
+
+def _read_indexed_hashes() -> set:
+    """sha256 hashes of files whose vectors were all upserted to Pinecone"""
+    try:
+        with open(config.INDEXED_HASHES_FILE, 'r', encoding='utf-8') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def _record_indexed_hashes(hashes):
+    """Mark files as fully indexed (written atomically, after their last batch succeeded)"""
+    indexed = _read_indexed_hashes() | set(hashes)
+    path = Path(config.INDEXED_HASHES_FILE)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = path.with_suffix(".json.tmp")
+        temp_file.write_text(json.dumps(sorted(indexed)), encoding='utf-8')
+        os.replace(temp_file, path)
+    except OSError as e:
+        print(f"⚠️  Could not record indexed files: {e}")
+
+
+def _legacy_filter(file_name: str) -> dict:
+    """Pinecone filter for a file's vectors from before doc_hash was stored"""
+    return {"file_name": {"$eq": file_name}, "doc_hash": {"$exists": False}}
+
+
+def _read_parse_cache(cache_file: Path):
+    """Load cached LlamaParse page texts (None if there's no usable cache entry)"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_parse_cache(cache_file: Path, texts: List[str]):
+    """Save LlamaParse page texts so the file never needs parsing again"""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(texts, f)
+    except OSError as e:
+        print(f"⚠️  Could not cache parse result: {e}")
+
+
+def _build_text_splitter():
+    """Sentence splitter that counts chunk sizes in the embedding model's own tokens"""
+    # Local models carry their tokenizer - measuring with it lets chunks fill
+    # the model's 512-token window without being truncated
+    tokenizer = getattr(getattr(Settings.embed_model, "_model", None), "tokenizer", None)
+    if tokenizer is None:
+        return SentenceSplitter(chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP)
+    
+    return SentenceSplitter(
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP,
+        tokenizer=partial(tokenizer.encode, add_special_tokens=False)
+    )
+
+
+def _model_slug(model_name: str) -> str:
+    """Filesystem-safe version of a model name (for cache file names)"""
+    return "".join(c if c.isalnum() else "_" for c in model_name)
+
+
+def _build_quantized_model(model_name, stella_kwargs):
+    """Load an int8 ONNX export of the model for CPU inference (None if it can't be built)
+
+    The export is done once and cached under CACHE_DIR/onnx/.
+    """
+    export_dir = Path(config.CACHE_DIR) / "onnx" / _model_slug(model_name)
+    onnx_file = f"onnx/model_qint8_{config.QUANTIZE_EMBEDDINGS_TARGET}.onnx"
+    
+    try:
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        
+        if not (export_dir / onnx_file).exists():
+            from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+            print(f"🔧 Exporting {model_name} to int8 ONNX (one-time)...")
+            model = SentenceTransformer(model_name, backend="onnx", trust_remote_code=True, **stella_kwargs)
+            model.save_pretrained(str(export_dir))
+            export_dynamic_quantized_onnx_model(model, config.QUANTIZE_EMBEDDINGS_TARGET, str(export_dir))
+        
+        return HuggingFaceEmbedding(
+            model_name=str(export_dir),
+            backend="onnx",
+            model_kwargs={"file_name": onnx_file},
+            trust_remote_code=True,
+            device="cpu",
+            embed_batch_size=config.EMBED_BATCH_SIZE,
+            **stella_kwargs
+        )
+    except Exception as e:
+        print(f"⚠️  Could not load int8 embeddings, using the full model: {e}")
+        return None
+
+
+def _quantize_local_model(embed_model) -> bool:
+    """Dynamically quantize the encoder's Linear layers to int8 (True if applied)"""
+    try:
+        import torch
+        transformer = embed_model._model[0]
+        transformer.auto_model = torch.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        return True
+    except Exception as e:
+        print(f"ℹ️  Dynamic int8 quantization not applied: {e}")
+        return False
+
+
+def _optimize_local_model(embed_model):
+    """Fuse the encoder's forward pass where possible (best effort - keeps the plain model on failure)"""
+    try:
+        import torch
+        transformer = embed_model._model[0]  # SentenceTransformer's HF transformer module
+    except (ImportError, AttributeError, IndexError, TypeError):
+        return
+    
+    # Let float32 matmuls use TF32 tensor cores on GPU
+    if torch.cuda.is_available():
+        torch.set_float32_matmul_precision('high')
+    
+    try:
+        from optimum.bettertransformer import BetterTransformer
+        transformer.auto_model = BetterTransformer.transform(transformer.auto_model, keep_original_model=False)
+    except ImportError:
+        pass
+    except Exception as e:
+        # Custom (trust_remote_code) architectures often aren't supported
+        print(f"ℹ️  BetterTransformer not applied: {e}")
+    
+    if config.EMBEDDING_COMPILE and hasattr(torch, "compile"):
+        try:
+            transformer.auto_model = torch.compile(transformer.auto_model, mode="reduce-overhead")
+        except Exception as e:
+            print(f"ℹ️  torch.compile not applied: {e}")
 
 
 class DocumentIngestion:
@@ -51,49 +335,34 @@ class DocumentIngestion:
     
     def __init__(self):
         """Initialize the document ingestion system"""
-        # Set up AI model
-        Settings.llm = Gemini(
-            model=config.GEMINI_MODEL,
-            api_key=config.GOOGLE_API_KEY,
-            temperature=0.7
-        )
-        
-        # Set up embeddings (local or Google)
-        self._setup_embeddings()
+        global _SETTINGS_READY
         
-        Settings.chunk_size = config.CHUNK_SIZE
-        Settings.chunk_overlap = config.CHUNK_OVERLAP
+        # Global settings only need configuring once per process - reloading
+        # the embedding model on every instantiation costs seconds
+        if not _SETTINGS_READY:
+            # Set up AI model
+            Settings.llm = Gemini(
+                model=config.GEMINI_MODEL,
+                api_key=config.GOOGLE_API_KEY,
+                temperature=0.7
+            )
+            
+            # Set up embeddings (local or Google)
+            self._setup_embeddings()
+            
+            Settings.text_splitter = _build_text_splitter()
+            _SETTINGS_READY = True
         
         self.index = None
         self.vector_store = None
+        self.embed_dim = None
         
         # Initialize cloud storage
         self._init_cloud_storage()
     
     def _setup_embeddings(self):
         """Set up embeddings (local or Google)"""
-        if config.USE_LOCAL_EMBEDDINGS:
-            # Stella model needs special config
-            if "stella" in config.LOCAL_EMBEDDING_MODEL.lower():
-                Settings.embed_model = HuggingFaceEmbedding(
-                    model_name=config.LOCAL_EMBEDDING_MODEL,
-                    trust_remote_code=True,
-                    device="cpu",
-                    config_kwargs={
-                        "use_memory_efficient_attention": False,
-                        "unpad_inputs": False
-                    }
-                )
-            else:
-                Settings.embed_model = HuggingFaceEmbedding(
-                    model_name=config.LOCAL_EMBEDDING_MODEL,
-                    trust_remote_code=True
-                )
-        else:
-            Settings.embed_model = GeminiEmbedding(
-                model_name=config.EMBEDDING_MODEL,
-                api_key=config.GOOGLE_API_KEY
-            )
+        Settings.embed_model = build_embed_model()
     
     def _init_cloud_storage(self):
         """Initialize Pinecone cloud vector storage"""
@@ -106,14 +375,14 @@ class DocumentIngestion:
             raise ValueError("PINECONE_API_KEY is required in .env file")
         
         try:
-            pc = Pinecone(api_key=config.PINECONE_API_KEY)
-            existing_indexes = [idx.name for idx in pc.list_indexes()]
+            pc = get_pinecone_client()
             
             # Get embedding dimension
             embed_dim = self._get_embedding_dimension()
+            self.embed_dim = embed_dim
             
             # Create or recreate index if needed
-            if config.PINECONE_INDEX_NAME not in existing_indexes:
+            if not pinecone_index_exists(pc):
                 self._create_pinecone_index(pc, embed_dim)
             else:
                 self._verify_index_dimensions(pc, embed_dim)
@@ -131,12 +400,31 @@ class DocumentIngestion:
         if hasattr(Settings.embed_model, 'embed_dim'):
             return Settings.embed_model.embed_dim
         
+        # Known models - no need to run the encoder at all
+        model_name = getattr(Settings.embed_model, 'model_name', None) or ""
+        if model_name in config.EMBEDDING_DIMENSIONS:
+            return config.EMBEDDING_DIMENSIONS[model_name]
+        
+        # Dimension probed on a previous run
+        cache_file = Path(config.CACHE_DIR) / f"embed_dim_{_model_slug(model_name)}.txt"
+        try:
+            return int(cache_file.read_text())
+        except (OSError, ValueError):
+            pass
+        
         # Try to get dimension by creating a test embedding
         try:
             test_embedding = Settings.embed_model.get_text_embedding("test")
-            return len(test_embedding)
+            dim = len(test_embedding)
         except:
             return 768  # Default fallback
+        
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(str(dim))
+        except OSError:
+            pass
+        return dim
     
     def _create_pinecone_index(self, pc, embed_dim):
         """Create a new Pinecone index"""
@@ -159,13 +447,24 @@ class DocumentIngestion:
             # Dimension mismatch - recreate index
             pc.delete_index(config.PINECONE_INDEX_NAME)
             
-            import time
-            time.sleep(5)  # Wait for deletion
+            self._wait_for_index_deletion(pc)
             
             self._create_pinecone_index(pc, embed_dim)
         else:
             print(f"✅ Using existing Pinecone index ({existing_dim} dimensions)")
     
+    def _wait_for_index_deletion(self, pc, timeout: float = 30.0):
+        """Poll until Pinecone reports the index gone (instead of sleeping a fixed time)"""
+        import time
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                pc.describe_index(config.PINECONE_INDEX_NAME)
+            except NotFoundException:
+                return
+            time.sleep(0.5)
+        print(f"⚠️  Index deletion still pending after {timeout:.0f}s")
+    
     def load_documents(self, directory: str = None) -> List:
         """Load documents from directory"""
         if directory is None:
@@ -177,61 +476,207 @@ class DocumentIngestion:
             os.makedirs(directory, exist_ok=True)
             return []
         
-        # Check for files
-        files = os.listdir(directory)
-        if not files:
+        # Check for files (stops at the first entry instead of listing them all)
+        with os.scandir(directory) as entries:
+            has_files = next(entries, None) is not None
+        if not has_files:
             print(f"⚠️  No documents found in {directory}")
             return []
         
+        # Skip files whose content is already in Pinecone
+        file_hashes = self._new_files(directory)
+        if not file_hashes:
+            print(f"✅ All documents in {directory} are already indexed")
+            return []
+        
         # Use LlamaParse if available, otherwise simple reader
+        files = list(file_hashes)
         if config.USE_LLAMA_PARSE and LLAMA_PARSE_AVAILABLE and config.LLAMA_CLOUD_API_KEY:
-            return self._load_with_llamaparse(directory)
+            documents = self._load_with_llamaparse(files, file_hashes)
         else:
-            return self._load_with_simple_reader(directory)
+            documents = self._load_with_simple_reader(files)
+        
+        self._stamp_doc_hashes(documents, file_hashes)
+        return documents
     
-    def _load_with_simple_reader(self, directory: str) -> List:
-        """Load documents using basic PDF extraction"""
-        reader = SimpleDirectoryReader(
-            input_dir=directory,
-            recursive=True,
-            required_exts=[".pdf", ".txt", ".docx", ".md"]
+    def _new_files(self, directory: str) -> dict:
+        """Find supported files in directory that aren't indexed yet
+        
+        A file only counts as indexed once every batch of its vectors was
+        upserted (see _record_indexed_hashes) and Pinecone still has them.
+        
+        Returns:
+            Dict mapping each new file path to its sha256 content hash
+        """
+        indexed = _read_indexed_hashes()
+        backfilled = []
+        new_files = {}
+        for path in sorted(Path(directory).rglob("*")):
+            if not (path.suffix.lower() in SUPPORTED_EXTS and path.is_file()):
+                continue
+            doc_hash = _file_sha256(path)
+            if doc_hash in indexed and self._is_hash_indexed(doc_hash):
+                print(f"   ⏭️  Skipping {path.name} (already indexed)")
+            elif doc_hash not in indexed and self._backfill_doc_hash(path, doc_hash):
+                print(f"   ⏭️  Skipping {path.name} (already indexed, hash added to its vectors)")
+                backfilled.append(doc_hash)
+            else:
+                new_files[str(path)] = doc_hash
+        
+        if backfilled:
+            _record_indexed_hashes(backfilled)
+        return new_files
+    
+    def _query_ids(self, metadata_filter: dict, top_k: int = 10000) -> List[str]:
+        """IDs of vectors matching a metadata filter (up to top_k, Pinecone's maximum by default)"""
+        # Any non-zero vector works - only the metadata filter matters
+        probe = [1.0] + [0.0] * (self.embed_dim - 1)
+        result = self.vector_store._pinecone_index.query(
+            vector=probe,
+            top_k=top_k,
+            filter=metadata_filter,
+            include_values=False
         )
+        return [match["id"] for match in result.get("matches", [])]
+    
+    def _is_hash_indexed(self, doc_hash: str) -> bool:
+        """Check whether Pinecone already has vectors for a file hash"""
+        try:
+            return bool(self._query_ids({"doc_hash": {"$eq": doc_hash}}, top_k=1))
+        except Exception as e:
+            # If we can't tell, index the file again rather than lose it
+            print(f"⚠️  Could not check for existing vectors: {e}")
+            return False
+    
+    def _backfill_doc_hash(self, path: Path, doc_hash: str) -> bool:
+        """Tag a file's vectors from before doc_hash was stored with its hash
+        
+        Those vectors are only known by file name, so they're adopted only when
+        the file is still the document recorded under that name. A replaced file
+        is indexed as new, and _delete_stale_vectors removes the old vectors.
+        
+        Returns:
+            True if the file had such vectors (so it's already indexed)
+        """
+        file_name = path.name
+        try:
+            if not matches_recorded_document(path):
+                return False
+            ids = self._query_ids(_legacy_filter(file_name))
+            pinecone_index = self.vector_store._pinecone_index
+            for vector_id in ids:
+                pinecone_index.update(id=vector_id, set_metadata={"doc_hash": doc_hash})
+        except Exception as e:
+            # Untagged leftovers are removed by _delete_stale_vectors before re-indexing
+            print(f"⚠️  Could not add file hash to existing vectors of {file_name}: {e}")
+            return False
+        return bool(ids)
+    
+    def _delete_stale_vectors(self, doc_files: dict):
+        """Remove vectors an interrupted ingest (or a pre-doc_hash one) left for these files
+        
+        Args:
+            doc_files: Dict mapping each doc_hash about to be indexed to its file name
+        """
+        for doc_hash, file_name in doc_files.items():
+            try:
+                ids = self._query_ids({"doc_hash": {"$eq": doc_hash}})
+                if file_name:
+                    ids += self._query_ids(_legacy_filter(file_name))
+                if ids:
+                    self.vector_store._pinecone_index.delete(ids=ids)
+            except Exception as e:
+                print(f"⚠️  Could not remove earlier vectors of {file_name or doc_hash}: {e}")
+    
+    def _stamp_doc_hashes(self, documents: List, file_hashes: dict):
+        """Record each document's file hash in its metadata (stored in Pinecone, not embedded)"""
+        hashes = {os.path.abspath(path): doc_hash for path, doc_hash in file_hashes.items()}
+        for doc in documents:
+            doc_hash = hashes.get(os.path.abspath(doc.metadata.get("file_path", "")))
+            if doc_hash is None:
+                continue
+            doc.metadata["doc_hash"] = doc_hash
+            doc.excluded_embed_metadata_keys.append("doc_hash")
+            doc.excluded_llm_metadata_keys.append("doc_hash")
+    
+    def _load_with_simple_reader(self, files: List[str]) -> List:
+        """Load documents using basic PDF extraction"""
+        reader = SimpleDirectoryReader(input_files=files, filename_as_id=True)
         return reader.load_data()
     
-    def _load_with_llamaparse(self, directory: str) -> List:
-        """Load documents using advanced PDF parsing with LlamaParse"""
+    def _load_with_llamaparse(self, files: List[str], file_hashes: dict = None) -> List:
+        """Load documents using advanced PDF parsing with LlamaParse
+        
+        Args:
+            files: Paths of the files to load
+            file_hashes: Optional path -> sha256 map, used to reuse cached parses
+        """
+        pdf_paths = [f for f in files if f.lower().endswith(".pdf")]
+        other_files = [f for f in files if not f.lower().endswith(".pdf")]
+        
         # Extract images from PDFs if enabled
         if config.EXTRACT_IMAGES and MULTIMODAL_AVAILABLE:
-            self._extract_pdf_images(directory)
+            self._extract_pdf_images(pdf_paths)
+        
+        documents = asyncio.run(self._aparse_pdfs(pdf_paths, file_hashes or {})) if pdf_paths else []
+        
+        # Everything else still goes through the simple reader
+        if other_files:
+            documents.extend(SimpleDirectoryReader(input_files=other_files, filename_as_id=True).load_data())
+        
+        return documents
+    
+    async def _aparse_pdfs(self, pdf_paths: List[str], file_hashes: dict) -> List:
+        """Parse PDFs with LlamaParse concurrently - each file is mostly waiting on the API
         
-        # Set up LlamaParse
+        Parses are cached on disk by file hash, so unchanged PDFs are never sent twice.
+        """
+        workers = min(config.LLAMA_PARSE_MAX_CONCURRENCY, len(pdf_paths))
         parser = LlamaParse(
             api_key=config.LLAMA_CLOUD_API_KEY,
             result_type=config.LLAMA_PARSE_RESULT_TYPE,
             verbose=True,
-            language="en"
+            language="en",
+            num_workers=workers
         )
+        semaphore = asyncio.Semaphore(workers)
         
-        reader = SimpleDirectoryReader(
-            input_dir=directory,
-            recursive=True,
-            required_exts=[".pdf", ".txt", ".docx", ".md"],
-            file_extractor={".pdf": parser}
-        )
-        return reader.load_data()
+        async def parse(pdf_path):
+            # Same file metadata SimpleDirectoryReader attached (used for source citations)
+            extra_info = {"file_name": os.path.basename(pdf_path), "file_path": pdf_path}
+            
+            doc_hash = file_hashes.get(pdf_path) or _file_sha256(pdf_path)
+            cache_file = Path(config.LLAMA_PARSE_CACHE_DIR) / f"{doc_hash}_{config.LLAMA_PARSE_RESULT_TYPE}.json"
+            cached = _read_parse_cache(cache_file)
+            if cached is not None:
+                print(f"   ♻️  Using cached parse for {extra_info['file_name']}")
+                return [Document(text=text, metadata=dict(extra_info)) for text in cached]
+            
+            async with semaphore:
+                try:
+                    docs = await parser.aload_data(pdf_path, extra_info=extra_info)
+                except Exception as e:
+                    print(f"   ⚠️ Could not parse {extra_info['file_name']}: {e}")
+                    return []
+            
+            _write_parse_cache(cache_file, [doc.text for doc in docs])
+            return docs
+        
+        results = await asyncio.gather(*(parse(pdf_path) for pdf_path in pdf_paths))
+        return [doc for docs in results for doc in docs]
     
-    def _extract_pdf_images(self, directory: str):
-        """Extract images from all PDFs in directory"""
-        pdf_files = [f for f in os.listdir(directory) if f.lower().endswith('.pdf')]
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(directory, pdf_file)
-            try:
-                process_pdf_multimodal(pdf_path)
-            except Exception as e:
-                print(f"   ⚠️ Could not process {pdf_file}: {e}")
+    def _extract_pdf_images(self, pdf_paths: List[str]):
+        """Extract images from PDFs (in parallel, one process per file)"""
+        process_pdfs_multimodal(pdf_paths)
     
-    def create_index(self, documents: List = None, force_new: bool = False):
-        """Create or load vector index from Pinecone"""
+    def create_index(self, documents: List = None, force_new: bool = False, progress_callback=None):
+        """Create or load vector index from Pinecone
+        
+        Args:
+            documents: Documents to index (loaded from the data directory if None)
+            force_new: Re-index even if the cloud index already has vectors
+            progress_callback: Optional fn(batches_done, total_batches) called while embedding
+        """
         if self.vector_store is None:
             print("❌ Cloud storage not initialized!")
             return None
@@ -247,17 +692,93 @@ class DocumentIngestion:
             documents = self.load_documents()
         
         if not documents:
-            print("❌ No documents to index. Please add documents to the data directory.")
-            return None
+            # Nothing new to embed - keep serving whatever is already indexed
+            index = self._load_existing_index()
+            if index is None:
+                print("❌ No documents to index. Please add documents to the data directory.")
+            return index
+        
+        # Start each file from scratch, so a half-finished earlier run can't leave duplicates
+        doc_files = {
+            doc.metadata["doc_hash"]: doc.metadata.get("file_name")
+            for doc in documents if "doc_hash" in doc.metadata
+        }
+        self._delete_stale_vectors(doc_files)
+        
+        # Chunk, then embed in concurrent batches - each batch is upserted to
+        # Pinecone as soon as it's embedded, so network I/O overlaps the compute
+        nodes = run_transformations(documents, Settings.transformations, show_progress=True)
+        self._embed_and_upsert(nodes, progress_callback)
+        
+        # Every batch made it (_embed_and_upsert raises otherwise)
+        _record_indexed_hashes(doc_files)
+        
+        # Cached answers were generated without the new documents - every engine
+        # (in any process) drops them once it sees the new stamp
+        stamp = Path(config.INDEX_STAMP_FILE)
+        stamp.parent.mkdir(parents=True, exist_ok=True)
+        stamp.touch()  # Updates the mtime of an existing stamp too
         
         storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
-        self.index = VectorStoreIndex.from_documents(
-            documents,
-            storage_context=storage_context,
-            show_progress=True
+        self.index = VectorStoreIndex.from_vector_store(
+            self.vector_store,
+            storage_context=storage_context
         )
         return self.index
     
+    def _embed_and_upsert(self, nodes, progress_callback=None):
+        """Embed nodes in batches and upsert each finished batch from a thread pool"""
+        batch_size = Settings.embed_model.embed_batch_size
+        batches = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+        
+        with ThreadPoolExecutor(max_workers=config.PINECONE_UPSERT_WORKERS) as upsert_pool:
+            upserts = []
+            
+            def upsert(batch):
+                upserts.append(upsert_pool.submit(self.vector_store.add, batch))
+            
+            asyncio.run(self._aembed_batches(batches, progress_callback, on_batch_done=upsert))
+            
+            # Surface any upsert failure
+            for future in upserts:
+                future.result()
+    
+    async def _aembed_batches(self, batches, progress_callback=None, on_batch_done=None):
+        """Embed node batches with up to EMBEDDING_PARALLEL_BATCHES requests in flight"""
+        semaphore = asyncio.Semaphore(config.EMBEDDING_PARALLEL_BATCHES)
+        done = 0
+        
+        async def embed(batch):
+            nonlocal done
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            async with semaphore:
+                embeddings = await self._aembed_with_retry(texts)
+            for node, embedding in zip(batch, embeddings):
+                node.embedding = embedding
+            if on_batch_done:
+                on_batch_done(batch)
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(batches))
+        
+        await asyncio.gather(*(embed(batch) for batch in batches))
+    
+    async def _aembed_with_retry(self, texts, max_retries: int = 3):
+        """Embed one batch, backing off exponentially on quota (429) errors"""
+        embed_model = Settings.embed_model
+        for attempt in range(max_retries + 1):
+            try:
+                if isinstance(embed_model, GeminiEmbedding):
+                    # Native async client - requests overlap on the event loop
+                    return await embed_model.aget_text_embedding_batch(texts)
+                # Local models only have BaseEmbedding's default async path, which runs the
+                # encoder on the event loop thread - a worker thread lets batches overlap
+                return await asyncio.to_thread(embed_model.get_text_embedding_batch, texts)
+            except Exception as e:
+                if not is_quota_error(e) or attempt == max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+    
     def _load_existing_index(self):
         """Load existing index from Pinecone"""
         try:
@@ -274,7 +795,7 @@ class DocumentIngestion:
                 return None
             
             return self.index
-        except Exception as e:
+        except PineconeException as e:
             print(f"⚠️  Could not load existing cloud index: {e}")
             print("No documents in cloud storage yet.")
             self.index = None
@@ -282,13 +803,8 @@ class DocumentIngestion:
     
     def _is_index_empty(self):
         """Check if Pinecone index is empty"""
-        try:
-            if hasattr(self.vector_store, '_pinecone_index'):
-                stats = self.vector_store._pinecone_index.describe_index_stats()
-                return stats.get('total_vector_count', 0) == 0
-        except:
-            pass
-        return False
+        pinecone_index = getattr(self.vector_store, '_pinecone_index', None)
+        return pinecone_index is None or pinecone_index.describe_index_stats().get('total_vector_count', 0) == 0
     
     def get_index(self):
         """Get the current index"""
@@ -319,7 +835,7 @@ def main():
         ingestion.create_index(documents, force_new=True)
         print("\n✨ Document ingestion completed successfully!")
     else:
-        print("\n⚠️  No documents found. Please add NASA documents to the 'data' directory.")
+        print("\n⚠️  No new documents found. Please add NASA documents to the 'data' directory.")
         print("Supported formats: PDF, TXT, DOCX, MD")
 
 
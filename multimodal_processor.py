@@ -3,11 +3,44 @@ Enhanced Multimodal Document Processor for NASA RAG System
 Handles images, tables, formulas, and charts from research papers
 """
 import os
+import hashlib
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
 import fitz  # PyMuPDF
+import orjson
 from PIL import Image
 import config
+from utils.rate_limit import RateLimiter, is_quota_error
+
+
+# Threads writing extracted image files to disk
+IMAGE_WRITE_WORKERS = 4
+
+# Shared by every description thread in this process
+_describe_limiter = RateLimiter(config.IMAGE_DESCRIPTION_RPS)
+
+IMAGE_PROMPT = """Analyze this image from a NASA research paper. Describe:
+1. What type of visualization is this (chart, diagram, photo, etc.)?
+2. What data or information does it show?
+3. Key findings or patterns visible
+4. Any labels, legends, or annotations
+
+Be technical and precise."""
+
+BATCH_IMAGE_PROMPT = """Analyze each of the {count} attached images from a NASA research paper.
+Each image is preceded by its label (img1, img2, ...). For every image, describe:
+1. What type of visualization is this (chart, diagram, photo, etc.)?
+2. What data or information does it show?
+3. Key findings or patterns visible
+4. Any labels, legends, or annotations
+
+Be technical and precise. Respond with a JSON object mapping each label to its
+description as a string, e.g. {{"img1": "...", "img2": "..."}}."""
 
 
 class MultimodalProcessor:
@@ -17,6 +50,13 @@ class MultimodalProcessor:
         """Initialize the multimodal processor"""
         self.image_dir = Path(config.IMAGE_EXTRACTION_DIR)
         self.image_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Descriptions keyed by SHA-256 of the image bytes - identical figures
+        # (re-processed PDFs, duplicates across papers) are only described once
+        self.desc_cache_file = self.image_dir / "desc_cache.json"
+        self._desc_cache = _load_json(self.desc_cache_file, {})
+        self._new_descriptions = {}
+        self._cache_lock = threading.Lock()
     
     def extract_images_from_pdf(self, pdf_path: str) -> List[Dict]:
         """
@@ -28,50 +68,133 @@ class MultimodalProcessor:
         Returns:
             List of dicts with image info and context
         """
+        return list(self.iter_images_from_pdf(pdf_path))
+    
+    def iter_images_from_pdf(self, pdf_path: str) -> Iterator[Dict]:
+        """
+        Extract images from a PDF page by page, yielding each one as soon as it's saved
+        
+        Args:
+            pdf_path: Path to PDF file
+            
+        Yields:
+            Dict with image info and context
+        """
         pdf_path = Path(pdf_path)
         doc = fitz.open(pdf_path)
-        extracted_images = []
         
-        for page_num, page in enumerate(doc):
-            # Get text from page for context
-            page_text = page.get_text()
-            
-            # Extract images
-            image_list = page.get_images()
-            
-            for img_index, img in enumerate(image_list):
-                try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_ext = base_image["ext"]
+        # Disk writes run in I/O threads: a page's images are written while the
+        # next page is extracted, and yielded once their files are on disk
+        pending = []
+        
+        # Logos and headers repeat on every page - keep only their first occurrence
+        seen_xrefs = set()
+        seen_digests = set()
+        try:
+            with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as io_pool:
+                for page_num, page in enumerate(doc):
+                    # Extract images - get_images() reports each image's size without
+                    # decoding it, so tiny and repeated images are dropped up front.
+                    # Indexes count every image on the page, so file names stay stable
+                    image_list = [
+                        (img_index, img) for img_index, img in enumerate(page.get_images(full=True))
+                        if img[0] not in seen_xrefs
+                        and min(img[2], img[3]) >= config.MIN_IMAGE_SIZE
+                    ]
+                    seen_xrefs.update(img[0] for _, img in image_list)
                     
-                    # Save image
-                    image_filename = f"{pdf_path.stem}_page{page_num+1}_img{img_index+1}.{image_ext}"
-                    image_path = self.image_dir / image_filename
+                    # Text-only page - skip the (much slower) text extraction entirely
+                    if not image_list:
+                        continue
                     
-                    with open(image_path, "wb") as img_file:
-                        img_file.write(image_bytes)
+                    # Text blocks (paragraphs with positions) - each image takes the nearest one as context
+                    text_blocks = [b for b in page.get_text("blocks") if b[6] == 0 and b[4].strip()]
+                    page_images = []
                     
-                    # Store metadata
-                    extracted_images.append({
-                        "path": str(image_path),
-                        "page": page_num + 1,
-                        "context": page_text[:500],  # Surrounding text
-                        "source_pdf": pdf_path.name,
-                        "type": "figure/chart"
-                    })
+                    for img_index, img in image_list:
+                        try:
+                            xref = img[0]
+                            base_image = doc.extract_image(xref)
+                            image_bytes = base_image["image"]
+                            image_ext = base_image["ext"]
+                        except Exception as e:
+                            print(f"⚠️  Could not extract image {img_index} from page {page_num}: {e}")
+                            continue
+                        
+                        # Same picture embedded under a different xref
+                        digest = hashlib.sha256(image_bytes).digest()
+                        if digest in seen_digests:
+                            continue
+                        seen_digests.add(digest)
+                        
+                        # Save image
+                        image_filename = f"{pdf_path.stem}_page{page_num+1}_img{img_index+1}.{image_ext}"
+                        image_path = self.image_dir / image_filename
+                        
+                        page_images.append((io_pool.submit(image_path.write_bytes, image_bytes), {
+                            "path": str(image_path),
+                            "page": page_num + 1,
+                            "context": _nearest_text(page, img, text_blocks)[:500],  # Surrounding text
+                            "source_pdf": pdf_path.name,
+                            "type": "figure/chart"
+                        }))
                     
-                except Exception as e:
-                    print(f"⚠️  Could not extract image {img_index} from page {page_num}: {e}")
+                    yield from _written(pending)
+                    pending = page_images
+                
+                yield from _written(pending)
+        finally:
+            doc.close()
+    
+    @cached_property
+    def vision_model(self):
+        """Gemini model used for image descriptions (configured once, on first use)"""
+        import google.generativeai as genai
+        genai.configure(api_key=config.GOOGLE_API_KEY)
         
-        doc.close()
-        return extracted_images
+        # Use Gemini 1.5 Flash (supports vision and is faster/cheaper)
+        return genai.GenerativeModel('gemini-1.5-flash')
+    
+    def _generate_with_retry(self, model, contents, max_retries: int = 3, **kwargs):
+        """Call Gemini under the shared rate limiter, backing off exponentially on quota errors"""
+        import time
+        for attempt in range(max_retries + 1):
+            _describe_limiter.wait()  # Avoid rate limiting
+            try:
+                return model.generate_content(contents, request_options={'timeout': 30}, **kwargs)
+            except Exception as e:
+                if not is_quota_error(e) or attempt == max_retries:
+                    raise
+                time.sleep(2 ** attempt)
+    
+    def _remember_description(self, image_hash: str, description: str):
+        """Add a description to the cache (saved by save_description_cache)"""
+        with self._cache_lock:
+            self._desc_cache[image_hash] = description
+            self._new_descriptions[image_hash] = description
+    
+    def save_description_cache(self):
+        """Write new descriptions to disk, merged with entries other processes may have added"""
+        with self._cache_lock:
+            if not self._new_descriptions:
+                return
+            merged = {**_load_json(self.desc_cache_file, {}), **self._new_descriptions}
+            self._new_descriptions = {}
+        
+        try:
+            temp_file = self.desc_cache_file.with_suffix(f".{os.getpid()}.tmp")
+            temp_file.write_bytes(orjson.dumps(merged))
+            os.replace(temp_file, self.desc_cache_file)
+        except OSError as e:
+            print(f"⚠️  Could not save image description cache: {e}")
     
     def describe_image_with_gemini(self, image_path: str) -> str:
         """
         Use Gemini Vision to describe images
         
+        Safe to call from several threads - calls are spaced by a shared rate limiter.
+        Images described before (same bytes) are answered from the cache.
+        
         Args:
             image_path: Path to image file
             
@@ -79,39 +202,188 @@ class MultimodalProcessor:
             Description of the image
         """
         try:
-            import google.generativeai as genai
-            import time
-            genai.configure(api_key=config.GOOGLE_API_KEY)
-            
-            # Use Gemini 1.5 Flash (supports vision and is faster/cheaper)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            img = Image.open(image_path)
-            
-            prompt = """Analyze this image from a NASA research paper. Describe:
-1. What type of visualization is this (chart, diagram, photo, etc.)?
-2. What data or information does it show?
-3. Key findings or patterns visible
-4. Any labels, legends, or annotations
-
-Be technical and precise."""
-            
-            response = model.generate_content(
-                [prompt, img],
-                request_options={'timeout': 30}
-            )
-            
-            time.sleep(1)  # Avoid rate limiting
+            image_hash = _image_hash(image_path)
+            if image_hash in self._desc_cache:
+                return self._desc_cache[image_hash]
             
+            response = self._generate_with_retry(self.vision_model, [IMAGE_PROMPT, _upload_image(image_path)])
+            self._remember_description(image_hash, response.text)
             return response.text
             
         except Exception as e:
             print(f"⚠️  Could not describe image {Path(image_path).name}: {e}")
             return "Image description not available"
+    
+    def describe_images_batch(self, image_paths: List[str], batch_size: int = config.IMAGE_DESCRIPTION_BATCH_SIZE) -> List[str]:
+        """
+        Describe several images per Gemini request
+        
+        Cached images are skipped. Images the batched answer doesn't cover
+        (or can't be parsed for) are described one at a time instead.
+        
+        Args:
+            image_paths: Paths to image files
+            batch_size: Images sent in each request
+            
+        Returns:
+            One description per image, in input order
+        """
+        described = {}
+        pending = []
+        for image_path in image_paths:
+            try:
+                cached = self._desc_cache.get(_image_hash(image_path))
+            except OSError:
+                cached = None
+            if cached:
+                described[image_path] = cached
+            else:
+                pending.append(image_path)
+        
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            
+            batch_descriptions = {}
+            try:
+                # Label every image so the JSON answer can be mapped back to it
+                contents = [BATCH_IMAGE_PROMPT.format(count=len(batch))]
+                for i, image_path in enumerate(batch, 1):
+                    contents += [f"img{i}:", _upload_image(image_path)]
+                
+                response = self._generate_with_retry(
+                    self.vision_model,
+                    contents,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+                batch_descriptions = orjson.loads(response.text)
+            except Exception as e:
+                print(f"⚠️  Batch image description failed, describing one by one: {e}")
+            
+            for i, image_path in enumerate(batch, 1):
+                description = batch_descriptions.get(f"img{i}") if isinstance(batch_descriptions, dict) else None
+                if isinstance(description, dict):
+                    description = "\n".join(f"{key}: {value}" for key, value in description.items())
+                if description:
+                    self._remember_description(_image_hash(image_path), description)
+                else:
+                    description = self.describe_image_with_gemini(image_path)
+                described[image_path] = description
+        
+        return [described[image_path] for image_path in image_paths]
+
+
+def _written(pending):
+    """Yield the metadata of images whose file writes succeeded"""
+    for write, img_data in pending:
+        try:
+            write.result()
+        except Exception as e:
+            print(f"⚠️  Could not save image {Path(img_data['path']).name}: {e}")
+            continue
+        yield img_data
+
+
+def _nearest_text(page, img, text_blocks) -> str:
+    """Text of the block closest to where an image is drawn on the page"""
+    if not text_blocks:
+        return ""
+    try:
+        img_rect = page.get_image_bbox(img)
+    except Exception:
+        img_rect = fitz.EMPTY_RECT()
+    if img_rect.is_empty or img_rect.is_infinite:
+        return text_blocks[0][4]
+    
+    def distance(block):
+        # Gap between the rectangles (0 if they overlap)
+        dx = max(block[0] - img_rect.x1, img_rect.x0 - block[2], 0)
+        dy = max(block[1] - img_rect.y1, img_rect.y0 - block[3], 0)
+        return dx * dx + dy * dy
+    
+    return min(text_blocks, key=distance)[4]
+
+
+def _upload_image(image_path: str) -> Dict:
+    """Downscaled JPEG copy of an image for Gemini (figures rarely need more than 1024px)"""
+    with Image.open(image_path) as img:
+        img.thumbnail((config.VISION_MAX_IMAGE_SIZE, config.VISION_MAX_IMAGE_SIZE), Image.Resampling.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")  # JPEG has no alpha or palette
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+
+def _image_hash(image_path: str) -> str:
+    """SHA-256 of an image file's bytes"""
+    with open(image_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
 
-def process_pdf_multimodal(pdf_path: str) -> Dict:
-    """Process a PDF with full multimodal extraction (images, text, metadata)"""
-    import json
+def _load_json(path: Path, default):
+    """Read a JSON file, or return default if it's missing or unreadable"""
+    try:
+        return orjson.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return default
+
+
+def _describe_enabled() -> bool:
+    """True if extracted images should be described with Gemini Vision"""
+    return bool(config.GOOGLE_API_KEY) and getattr(config, 'DESCRIBE_IMAGES_WITH_AI', True)
+
+
+def _describe_images(processor: MultimodalProcessor, images: Iterable[Dict]) -> List[Dict]:
+    """
+    Add a Gemini Vision "description" to each image dict
+    
+    Several images go in each request, and several requests run at once (the
+    limiter keeps us under quota). Each batch is submitted as soon as it's full,
+    so when images is a generator, descriptions overlap the rest of the extraction.
+    
+    Args:
+        processor: Processor whose vision model and description cache are used
+        images: Image metadata dicts (consumed lazily)
+        
+    Returns:
+        The described image dicts, in input order
+    """
+    batch_size = config.IMAGE_DESCRIPTION_BATCH_SIZE
+    batches = []
+    described = []
+    
+    with ThreadPoolExecutor(max_workers=config.IMAGE_DESCRIPTION_WORKERS) as executor:
+        batch = []
+        for img_data in images:
+            batch.append(img_data)
+            if len(batch) == batch_size:
+                batches.append((batch, executor.submit(processor.describe_images_batch, [i["path"] for i in batch])))
+                batch = []
+        if batch:
+            batches.append((batch, executor.submit(processor.describe_images_batch, [i["path"] for i in batch])))
+        
+        for batch, future in batches:
+            for img_data, description in zip(batch, future.result()):
+                img_data["description"] = description
+            described.extend(batch)
+    
+    processor.save_description_cache()
+    return described
+
+
+def process_pdf_multimodal(pdf_path: str, save_metadata: bool = True, describe: bool = True) -> Dict:
+    """
+    Process a PDF with full multimodal extraction (images, text, metadata)
+    
+    Kept at module level so it can be pickled and run in a worker process.
+    
+    Args:
+        pdf_path: Path to PDF file
+        save_metadata: Write image metadata here - pass False when several PDFs are
+            processed in parallel and the caller saves them all in one go
+        describe: Describe images with Gemini Vision (if enabled in config) - pass
+            False to only extract them and leave the API calls to the caller
+    """
     processor = MultimodalProcessor()
     
     result = {
@@ -122,45 +394,156 @@ def process_pdf_multimodal(pdf_path: str) -> Dict:
     }
     
     if config.EXTRACT_IMAGES:
-        result["images"] = processor.extract_images_from_pdf(pdf_path)
-        
         # Describe images with AI if enabled
-        if config.GOOGLE_API_KEY and getattr(config, 'DESCRIBE_IMAGES_WITH_AI', True):
-            for img_data in result["images"]:
-                img_data["description"] = processor.describe_image_with_gemini(img_data["path"])
+        if describe and _describe_enabled():
+            result["images"] = _describe_images(processor, processor.iter_images_from_pdf(pdf_path))
+        else:
+            result["images"] = processor.extract_images_from_pdf(pdf_path)
         
         # Save metadata
-        if result["images"]:
-            _save_image_metadata(result["images"])
+        if save_metadata and result["images"]:
+            save_image_metadata(result["images"])
     
     return result
 
 
-def _save_image_metadata(new_images: List[Dict]):
-    """Save or append image metadata to JSON file"""
-    import json
-    from pathlib import Path
+def _process_pdf_isolated(pdf_path: str) -> Dict:
+    """Worker wrapper: extract only, and one bad PDF returns an error instead of failing the whole batch"""
+    try:
+        return process_pdf_multimodal(pdf_path, save_metadata=False, describe=False)
+    except Exception as e:
+        return {"pdf_path": pdf_path, "images": [], "tables": [], "text": "", "error": str(e)}
+
+
+def process_pdfs_multimodal(pdf_paths: List[str], executor=None) -> List[Dict]:
+    """
+    Process several PDFs in parallel, one worker process per file
     
-    metadata_file = Path(config.IMAGE_EXTRACTION_DIR) / "image_metadata.json"
+    Image extraction is CPU-bound, so processes (not threads) spread it across cores.
+    Gemini Vision calls are then made from this process's thread pool, so one rate
+    limiter and one description cache cover the whole batch. Image metadata for the
+    whole batch is saved once, after every file finishes.
     
-    # Load existing metadata
-    existing_images = []
-    if metadata_file.exists():
-        try:
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                existing_images = json.load(f)
-        except:
-            pass
+    Args:
+        pdf_paths: Paths to PDF files
+        executor: Process pool to reuse (a temporary one is created if None)
+        
+    Returns:
+        One result dict per PDF, in input order (failed files carry an "error" key)
+    """
+    if not pdf_paths:
+        return []
+    
+    if executor is None:
+        # Spawn, not fork - callers may be running inside a threaded server
+        with ProcessPoolExecutor(
+            max_workers=min(len(pdf_paths), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = list(pool.map(_process_pdf_isolated, pdf_paths))
+    else:
+        results = list(executor.map(_process_pdf_isolated, pdf_paths))
+    
+    images = []
+    for result in results:
+        if "error" in result:
+            print(f"   ⚠️ Could not process {Path(result['pdf_path']).name}: {result['error']}")
+        images.extend(result["images"])
+    
+    # Descriptions fill in the dicts that the per-PDF results also hold
+    if images and _describe_enabled():
+        _describe_images(MultimodalProcessor(), images)
+    
+    # One metadata write for the whole batch (workers don't touch the file)
+    if images:
+        save_image_metadata(images)
+    
+    return results
+
+
+IMAGE_METADATA_FILE = Path(config.IMAGE_EXTRACTION_DIR) / "image_metadata.jsonl"
+LEGACY_IMAGE_METADATA_FILE = Path(config.IMAGE_EXTRACTION_DIR) / "image_metadata.json"
+
+# Paths already in the metadata file, and the file size they were read at
+_known_paths = set()
+_known_paths_size = None
+
+# Set once this process has converted (or found no) legacy image_metadata.json
+_MIGRATED = False
+_MIGRATION_LOCK = threading.Lock()
+
+
+def image_metadata_file() -> Path:
+    """
+    Path of the image metadata file, migrating the legacy JSON array first
+    
+    Every reader and writer goes through this, so a process that only reads
+    (e.g. the query engine) converts an old image_metadata.json too. The check
+    runs once per process.
+    
+    Returns:
+        IMAGE_METADATA_FILE
+    """
+    global _MIGRATED
+    if not _MIGRATED:
+        with _MIGRATION_LOCK:
+            if not _MIGRATED:
+                _migrate_legacy_metadata()
+                _MIGRATED = True
+    return IMAGE_METADATA_FILE
+
+
+def _migrate_legacy_metadata():
+    """Convert the old single-array image_metadata.json to JSON Lines"""
+    if IMAGE_METADATA_FILE.exists() or not LEGACY_IMAGE_METADATA_FILE.exists():
+        return
+    try:
+        images = orjson.loads(LEGACY_IMAGE_METADATA_FILE.read_bytes())
+        temp_file = IMAGE_METADATA_FILE.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_file, 'wb') as f:
+            f.writelines(orjson.dumps(img) + b"\n" for img in images)
+        os.replace(temp_file, IMAGE_METADATA_FILE)
+        LEGACY_IMAGE_METADATA_FILE.unlink()
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Could not migrate image metadata: {e}")
+
+
+def iter_image_metadata() -> Iterator[Dict]:
+    """Stream image metadata records one line at a time"""
+    try:
+        with open(image_metadata_file(), 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def save_image_metadata(new_images: List[Dict]):
+    """Append image metadata to the JSON Lines file (skipping images already recorded)"""
+    global _known_paths, _known_paths_size
+    metadata_file = image_metadata_file()
+    
+    # Re-read the known paths only if someone else changed the file
+    try:
+        size = metadata_file.stat().st_size
+    except OSError:
+        size = 0
+    if size != _known_paths_size:
+        _known_paths = {img['path'] for img in iter_image_metadata()}
     
     # Avoid duplicates
-    existing_paths = {img['path'] for img in existing_images}
+    lines = []
     for img in new_images:
-        if img['path'] not in existing_paths:
-            existing_images.append(img)
+        if img['path'] not in _known_paths:
+            _known_paths.add(img['path'])
+            lines.append(orjson.dumps(img) + b"\n")
     
-    # Save
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(existing_images, f, indent=2)
+    # Append only the new records - the file is never rewritten
+    if lines:
+        with open(metadata_file, 'ab', buffering=1 << 16) as f:
+            f.writelines(lines)
+    _known_paths_size = size + sum(len(line) for line in lines)
 
 
 if __name__ == "__main__":
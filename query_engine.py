@@ -3,17 +3,22 @@ Query Engine Module for NASA RAG System
 Handles querying the indexed documents
 """
 import os
+import json
+import threading
 import warnings
+from collections import OrderedDict
+from pathlib import Path
+from functools import lru_cache, cached_property
+
+import numpy as np
 
 # Suppress Google gRPC warnings
 os.environ['GRPC_VERBOSITY'] = 'ERROR'
 os.environ['GLOG_minloglevel'] = '2'
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
-from llama_index.core import Settings, StorageContext, VectorStoreIndex
+from llama_index.core import Settings, StorageContext, VectorStoreIndex, QueryBundle
 from llama_index.llms.gemini import Gemini
-from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
 # Cloud storage imports
 try:
@@ -24,34 +29,248 @@ except ImportError:
     PINECONE_AVAILABLE = False
 
 import config
-from document_ingestion import DocumentIngestion
+from document_ingestion import DocumentIngestion, get_pinecone_client, pinecone_index_exists
+from utils.rate_limit import is_quota_error
+
+
+def _stem(file_name: str) -> str:
+    """File name without directory or extension (os.path - no Path object per lookup)"""
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+def _embed_query(text: str) -> tuple:
+    """Embed a question with the active embedding model (cached, so repeated questions skip the embedder)"""
+    embed_model = Settings.embed_model
+    return _cached_embedding(text, getattr(embed_model, "model_name", type(embed_model).__name__))
+
+
+@lru_cache(maxsize=1024)
+def _cached_embedding(text: str, model_name: str) -> tuple:
+    """Embedding of text - model_name is part of the key so a swapped embedder never reuses old vectors"""
+    return tuple(Settings.embed_model.get_query_embedding(text))
+
+
+def clear_embedding_cache():
+    """Forget cached question embeddings (call after the embedding model is rebuilt)"""
+    _cached_embedding.cache_clear()
+
+
+# Chat turns that don't need retrieval or Gemini (compared lowercased, without trailing punctuation)
+GREETINGS = frozenset({
+    "hi", "hello", "hey", "hiya", "yo", "good morning", "good afternoon", "good evening",
+    "thanks", "thank you", "thx", "ty", "cheers", "ok", "okay", "cool", "bye", "goodbye"
+})
+
+
+@lru_cache(maxsize=1)
+def _qa_prompt():
+    """Answer prompt built around config.SYSTEM_PROMPT (parsed once, shared by every engine)"""
+    from llama_index.core.prompts import PromptTemplate
+    
+    return PromptTemplate(
+        config.SYSTEM_PROMPT + 
+        "\n\n=== CONTEXT FROM NASA RESEARCH PAPERS ===\n"
+        "{context_str}\n"
+        "=== END OF CONTEXT ===\n\n"
+        "IMPORTANT: Use ONLY the information provided in the context above. Do not use external knowledge.\n\n"
+        "Question: {query_str}\n\n"
+        "Answer (based ONLY on the context above): "
+    )
+
+
+def _index_generation():
+    """Version of the indexed corpus - mtime of the stamp file create_index touches (-1 if never)"""
+    try:
+        return os.stat(config.INDEX_STAMP_FILE).st_mtime_ns
+    except OSError:
+        return -1
+
+
+class SemanticCache:
+    """LRU of answered questions, matched by cosine similarity of their embeddings
+    
+    Shared by every session using the engine, so all access goes through a lock.
+    Entries are dropped whenever new documents are indexed (see _index_generation),
+    and writes to disk are debounced onto a background timer.
+    """
+    
+    def __init__(self, path: str, max_size: int, threshold: float, save_delay: float = 5.0):
+        """Initialize the cache (entries are loaded from disk on first use)"""
+        self.path = Path(path)
+        self.max_size = max_size
+        self.threshold = threshold
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._entries = None  # OrderedDict: embedding tuple -> result dict
+        self._matrix = None  # Stacked unit embeddings, rebuilt after changes
+        self._keys = None  # Entry keys in the same order as _matrix rows
+        self._generation = None  # Index generation the entries were answered against
+        self._save_timer = None
+    
+    def _sync(self):
+        """Load entries on first use, and drop them if documents were indexed since (lock held)"""
+        generation = _index_generation()
+        if self._entries is not None and generation == self._generation:
+            return
+        
+        self._entries = OrderedDict()
+        self._matrix = self._keys = None
+        if self._generation is None:
+            self._load(generation)
+        self._generation = generation
+    
+    def _load(self, generation):
+        """Read persisted entries, if they match the current index (lock held)"""
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if int(data["generation"]) != generation:
+                    return
+                for embedding, result in zip(data["embeddings"], data["results"]):
+                    self._entries[tuple(embedding.tolist())] = json.loads(str(result))
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    def _schedule_save(self):
+        """Save a few seconds from now, folding bursts of answers into one write (lock held)"""
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def flush(self):
+        """Persist entries as .npz (embeddings + JSON-encoded results)"""
+        with self._lock:
+            self._save_timer = None
+            if self._entries is None:
+                return
+            embeddings = np.array(list(self._entries), dtype=np.float32)
+            results = np.array([json.dumps(r) for r in self._entries.values()])
+            generation = np.int64(self._generation)
+        
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_file, 'wb') as f:
+                np.savez(f, embeddings=embeddings, results=results, generation=generation)
+            os.replace(temp_file, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  Could not save response cache: {e}")
+    
+    def get(self, embedding):
+        """Return the cached result for a near-identical question, or None"""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        
+        with self._lock:
+            self._sync()
+            if not self._entries:
+                return None
+            
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                matrix = np.array(self._keys, dtype=np.float32)
+                self._matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+            
+            similarities = self._matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            
+            key = self._keys[best]
+            self._entries.move_to_end(key)
+            return self._entries[key]
+    
+    def put(self, embedding, result: dict):
+        """Remember an answer, evicting the least recently used beyond max_size"""
+        key = tuple(embedding)
+        with self._lock:
+            self._sync()
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = self._keys = None
+            self._schedule_save()
 
 
 class QueryEngine:
     """Handles querying the NASA document index"""
     
     def __init__(self, starting_model_index: int = 0):
-        """Initialize the query engine"""
+        """Initialize the query engine
+        
+        This is cheap - the LLM, embedding model and cloud index are only
+        loaded the first time the index or a query engine is needed.
+        """
         self.available_models = [config.GEMINI_MODEL] + config.FALLBACK_MODELS
         self.model_index = starting_model_index
         self.current_model = self.available_models[self.model_index]
         
-        # Set up AI model and embeddings
-        self._setup_llm()
-        self._setup_embeddings()
-        
-        # Initialize cloud storage and load documents
         self.vector_store = None
-        self._init_cloud_storage()
+        self.ingestion = None
         
+        # The engine is shared across sessions (st.cache_resource) - only one of them
+        # runs the model/Pinecone setup; reentrant since the query engines load the index
+        self._init_lock = threading.RLock()
+        
+        # Answers to recent questions - near-duplicates skip retrieval and generation
+        self._qcache = SemanticCache(
+            config.RESPONSE_CACHE_FILE,
+            max_size=config.RESPONSE_CACHE_SIZE,
+            threshold=config.RESPONSE_CACHE_THRESHOLD
+        )
+        
+        # Source document stem -> its images (loaded on first use, refreshed when the file changes)
+        self._images_by_doc = {}
+        self._image_index_mtime = -1  # Never a real mtime (nor None for a missing file), so the first call always builds
+    
+    @cached_property
+    def index(self):
+        """Vector index (loads the models and cloud storage on first access)"""
+        with self._init_lock:
+            # Another session may have finished loading while this one waited.
+            # Stored before the lock is released - cached_property only does it afterwards
+            if 'index' not in self.__dict__:
+                self.__dict__['index'] = self._load_index()
+            return self.__dict__['index']
+    
+    def _load_index(self):
+        """Load the models and cloud storage, and return the index (init lock held)"""
+        # The embedding model and chunking settings are shared with ingestion
+        # and only configured once per process
         self.ingestion = DocumentIngestion()
-        self.index = self.ingestion.get_index()
         
-        # Create query engine with prompt template
-        if self.index:
-            self.query_engine = self._create_query_engine()
-        else:
-            self.query_engine = None
+        # Set up AI model (after ingestion's default, so the chosen model wins)
+        self._setup_llm()
+        
+        # Initialize cloud storage and load documents
+        self._init_cloud_storage()
+        return self.ingestion.get_index()
+    
+    @cached_property
+    def query_engine(self):
+        """Buffered query engine with prompt template (None if nothing is indexed)"""
+        with self._init_lock:
+            if 'query_engine' not in self.__dict__:
+                self.__dict__['query_engine'] = self._create_query_engine() if self.index else None
+            return self.__dict__['query_engine']
+    
+    @cached_property
+    def streaming_query_engine(self):
+        """Streaming query engine with prompt template (None if nothing is indexed)"""
+        with self._init_lock:
+            if 'streaming_query_engine' not in self.__dict__:
+                self.__dict__['streaming_query_engine'] = self._create_query_engine(streaming=True) if self.index else None
+            return self.__dict__['streaming_query_engine']
+    
+    @property
+    def is_ready(self) -> bool:
+        """True once the models and index have been loaded"""
+        return 'index' in self.__dict__
+    
+    def warmup(self):
+        """Load the models and index now instead of on the first query"""
+        return self.query_engine is not None and self.streaming_query_engine is not None
     
     def _setup_llm(self):
         """Set up the language model"""
@@ -61,50 +280,18 @@ class QueryEngine:
             temperature=0.7
         )
     
-    def _setup_embeddings(self):
-        """Set up embeddings (local or Google)"""
-        if config.USE_LOCAL_EMBEDDINGS:
-            # Stella model needs special config
-            if "stella" in config.LOCAL_EMBEDDING_MODEL.lower():
-                Settings.embed_model = HuggingFaceEmbedding(
-                    model_name=config.LOCAL_EMBEDDING_MODEL,
-                    trust_remote_code=True,
-                    device="cpu",
-                    config_kwargs={
-                        "use_memory_efficient_attention": False,
-                        "unpad_inputs": False
-                    }
-                )
-            else:
-                Settings.embed_model = HuggingFaceEmbedding(
-                    model_name=config.LOCAL_EMBEDDING_MODEL,
-                    trust_remote_code=True
-                )
-        else:
-            Settings.embed_model = GeminiEmbedding(
-                model_name=config.EMBEDDING_MODEL,
-                api_key=config.GOOGLE_API_KEY
-            )
+    def _query_bundle(self, question: str) -> QueryBundle:
+        """Wrap a question with its (cached) embedding so the retriever doesn't re-embed it"""
+        return QueryBundle(query_str=question, embedding=list(_embed_query(question)))
     
-    def _create_query_engine(self):
+    def _create_query_engine(self, streaming: bool = False):
         """Create query engine with prompt template"""
-        from llama_index.core.prompts import PromptTemplate
-        
-        qa_prompt = PromptTemplate(
-            config.SYSTEM_PROMPT + 
-            "\n\n=== CONTEXT FROM NASA RESEARCH PAPERS ===\n"
-            "{context_str}\n"
-            "=== END OF CONTEXT ===\n\n"
-            "IMPORTANT: Use ONLY the information provided in the context above. Do not use external knowledge.\n\n"
-            "Question: {query_str}\n\n"
-            "Answer (based ONLY on the context above): "
-        )
-        
         return self.index.as_query_engine(
             similarity_top_k=config.TOP_K_RESULTS,
             response_mode="compact",
-            text_qa_template=qa_prompt,
-            similarity_cutoff=config.RELEVANCE_THRESHOLD
+            text_qa_template=_qa_prompt(),
+            similarity_cutoff=config.RELEVANCE_THRESHOLD,
+            streaming=streaming
         )
     
     def _init_cloud_storage(self):
@@ -116,13 +303,11 @@ class QueryEngine:
             raise ValueError("PINECONE_API_KEY is required in .env file")
         
         try:
-            # Initialize Pinecone
-            pc = Pinecone(api_key=config.PINECONE_API_KEY)
+            # Initialize Pinecone (client shared with ingestion)
+            pc = get_pinecone_client()
             
             # Check if index exists
-            existing_indexes = [idx.name for idx in pc.list_indexes()]
-            
-            if config.PINECONE_INDEX_NAME not in existing_indexes:
+            if not pinecone_index_exists(pc):
                 # Index doesn't exist - this is OK, it will be created on first upload
                 print(f"⚠️  Pinecone index '{config.PINECONE_INDEX_NAME}' doesn't exist yet.")
                 print(f"💡 It will be created automatically when you upload your first document.")
@@ -149,37 +334,48 @@ class QueryEngine:
         self.current_model = self.available_models[self.model_index]
         self._setup_llm()
         
-        # Recreate query engine with new model
-        if self.index:
-            self.query_engine = self._create_query_engine()
+        # Only the synthesizer talks to the LLM - point the existing engines at the
+        # new model instead of rebuilding their retriever and prompt templates
+        for name in ('query_engine', 'streaming_query_engine'):
+            engine = self.__dict__.get(name)
+            if engine is None:
+                continue
+            synthesizer = getattr(engine, '_response_synthesizer', None)
+            if synthesizer is not None and hasattr(synthesizer, '_llm'):
+                synthesizer._llm = Settings.llm
+            else:
+                setattr(self, name, self._create_query_engine(streaming=name == 'streaming_query_engine'))
         
         return True
     
     def _is_quota_error(self, error: Exception) -> bool:
         """Check if error is related to quota/rate limiting"""
-        error_str = str(error).lower()
-        quota_indicators = [
-            "quota",
-            "rate limit",
-            "resource exhausted",
-            "429",
-            "too many requests",
-            "limit exceeded"
-        ]
-        return any(indicator in error_str for indicator in quota_indicators)
+        return is_quota_error(error)
     
     def query(self, question: str, on_model_switch=None) -> dict:
         """Query documents with automatic fallback on errors"""
+        # Greetings and empty/oversized questions are answered without loading the engine
+        trivial = self._trivial_response(question)
+        if trivial is not None:
+            return trivial
+        
         # No documents uploaded yet
         if not self.query_engine:
             return self._no_documents_response()
         
+        try:
+            cached = self._qcache.get(_embed_query(question))
+        except Exception as e:
+            return self._error_response(e)
+        if cached is not None:
+            return cached
+        
         max_retries = len(self.available_models)
         last_error = None
         
         for attempt in range(max_retries):
             try:
-                response = self.query_engine.query(question)
+                response = self.query_engine.query(self._query_bundle(question))
                 
                 # Check for empty response
                 if not str(response).strip():
@@ -189,11 +385,13 @@ class QueryEngine:
                 sources, source_documents = self._extract_sources(response)
                 relevant_images = self._get_images_for_sources(source_documents)
                 
-                return {
+                result = {
                     "response": str(response),
                     "sources": sources,
                     "images": relevant_images
                 }
+                self._qcache.put(_embed_query(question), result)
+                return result
                 
             except Exception as e:
                 last_error = e
@@ -212,6 +410,129 @@ class QueryEngine:
         # Return friendly error message
         return self._error_response(last_error)
     
+    def query_stream(self, question: str, on_model_switch=None) -> dict:
+        """Query documents and stream the answer as Gemini generates it
+        
+        Returns the same dict as query(), except the answer text comes from
+        "response_gen" (an iterator of text deltas) instead of "response".
+        Sources and images are available straight away, before generation starts.
+        """
+        trivial = self._trivial_response(question)
+        if trivial is not None:
+            return self._as_stream(trivial)
+        
+        if not self.streaming_query_engine:
+            return self._as_stream(self._no_documents_response())
+        
+        try:
+            cached = self._qcache.get(_embed_query(question))
+        except Exception as e:
+            return self._as_stream(self._error_response(e))
+        if cached is not None:
+            return self._as_stream(cached)
+        
+        try:
+            response = self._start_stream(question, on_model_switch)
+        except Exception as e:
+            return self._as_stream(self._error_response(e))
+        
+        sources, source_documents = self._extract_sources(response)
+        images = self._get_images_for_sources(source_documents)
+        return {
+            "response_gen": self._stream_tokens(question, response, on_model_switch, sources, images),
+            "sources": sources,
+            "images": images
+        }
+    
+    def _start_stream(self, question: str, on_model_switch=None):
+        """Start a streaming query, switching to a fallback model on quota errors
+        
+        Raises the last error if every model fails.
+        """
+        while True:
+            try:
+                return self.streaming_query_engine.query(self._query_bundle(question))
+            except Exception as e:
+                if not self._is_quota_error(e) or not self._switch_to_fallback_model():
+                    raise
+                if on_model_switch:
+                    on_model_switch(self.model_index)
+    
+    def _stream_tokens(self, question: str, response, on_model_switch=None, sources=None, images=None):
+        """Yield answer text, switching to a fallback model if quota runs out before the first token
+        
+        A fully streamed answer is added to the response cache.
+        """
+        while True:
+            started = False
+            deltas = []
+            try:
+                for delta in response.response_gen:
+                    started = True
+                    deltas.append(delta)
+                    yield delta
+                
+                if not started:
+                    yield self._no_documents_response()["response"]
+                    return
+                
+                self._qcache.put(_embed_query(question), {
+                    "response": "".join(deltas),
+                    "sources": sources or [],
+                    "images": images or []
+                })
+                return
+            
+            except Exception as e:
+                # Only retry if nothing has been shown yet - otherwise the answer would repeat
+                if started or not self._is_quota_error(e) or not self._switch_to_fallback_model():
+                    yield ("\n\n" if started else "") + self._error_response(e)["response"]
+                    return
+                
+                if on_model_switch:
+                    on_model_switch(self.model_index)
+                try:
+                    response = self._start_stream(question, on_model_switch)
+                except Exception as retry_error:
+                    yield self._error_response(retry_error)["response"]
+                    return
+    
+    def _as_stream(self, result: dict) -> dict:
+        """Turn a buffered response dict into the query_stream() shape"""
+        result = dict(result)
+        result["response_gen"] = iter([result.pop("response")])
+        return result
+    
+    def _trivial_response(self, question: str):
+        """Canned response for greetings, near-empty or oversized input (None for real questions)"""
+        text = question.strip()
+        
+        if text.lower().rstrip("!.?, ") in GREETINGS:
+            print("ℹ️  Trivial query (greeting) - skipping retrieval")
+            return {
+                "response": "Hi! 👋 I'm **Alexi**, ready to dig into your NASA research papers. 🚀 Ask me anything about them - findings, methods, figures - and I'll answer with sources!",
+                "sources": [],
+                "images": []
+            }
+        
+        if len(text) < 3:
+            print("ℹ️  Trivial query (too short) - skipping retrieval")
+            return {
+                "response": "Could you tell me a bit more about what you'd like to know? 🤔 Ask a full question about your NASA research papers and I'll look it up!",
+                "sources": [],
+                "images": []
+            }
+        
+        if len(text) > config.MAX_QUESTION_LENGTH:
+            print(f"ℹ️  Trivial query (too long: {len(text)} chars) - skipping retrieval")
+            return {
+                "response": f"That's a lot of text! 📜 Please keep questions under {config.MAX_QUESTION_LENGTH} characters - try asking about one specific part at a time.",
+                "sources": [],
+                "images": []
+            }
+        
+        return None
+    
     def _no_documents_response(self):
         """Response when no documents are uploaded"""
         return {
@@ -222,20 +543,23 @@ class QueryEngine:
     
     def _extract_sources(self, response):
         """Extract relevant sources from query response"""
-        sources = []
-        source_documents = set()
-        
-        if hasattr(response, 'source_nodes'):
-            for node in response.source_nodes:
-                if node.score >= config.RELEVANCE_THRESHOLD:
-                    sources.append({
-                        "text": node.node.text[:200] + "...",
-                        "score": node.score,
-                        "metadata": node.node.metadata
-                    })
-                    
-                    if 'file_name' in node.node.metadata:
-                        source_documents.add(node.node.metadata['file_name'])
+        nodes = getattr(response, 'source_nodes', None) or []
+        
+        # Threshold every score in one vector op, then only touch the nodes that pass
+        scores = np.fromiter((node.score or 0.0 for node in nodes), dtype=np.float32, count=len(nodes))
+        keep = [nodes[i] for i in np.flatnonzero(scores >= config.RELEVANCE_THRESHOLD)]
+        
+        sources = [
+            {
+                "text": node.node.text[:200] + "...",
+                "score": node.score,
+                "metadata": node.node.metadata
+            }
+            for node in keep
+        ]
+        source_documents = frozenset(
+            node.node.metadata['file_name'] for node in keep if 'file_name' in node.node.metadata
+        )
         
         return sources, source_documents
     
@@ -255,41 +579,48 @@ class QueryEngine:
             }
     
     
-    def _get_images_for_sources(self, source_documents: set) -> list:
-        """Get relevant images from source documents"""
-        import json
-        from pathlib import Path
+    def _reload_image_index(self):
+        """Group image metadata by source document, rebuilding only when the file changes"""
+        from multimodal_processor import image_metadata_file, iter_image_metadata
         
-        images = []
-        image_metadata_file = Path(config.IMAGE_EXTRACTION_DIR) / "image_metadata.json"
+        try:
+            mtime = image_metadata_file().stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._image_index_mtime:
+            return
         
-        if not image_metadata_file.exists():
-            return images
+        images_by_doc = {}
+        for img_data in iter_image_metadata():
+            doc_stem = _stem(img_data.get('source_pdf', ''))
+            images_by_doc.setdefault(doc_stem, []).append(img_data)
         
+        self._images_by_doc = images_by_doc
+        self._image_index_mtime = mtime
+    
+    def _get_images_for_sources(self, source_documents: set) -> list:
+        """Get relevant images from source documents"""
         try:
-            with open(image_metadata_file, 'r', encoding='utf-8') as f:
-                all_images = json.load(f)
-            
-            # Filter images by source documents
-            for img_data in all_images:
-                source_pdf = img_data.get('source_pdf', '')
-                source_name = source_pdf.replace('.pdf', '')
-                
-                # Check if image is from a relevant source
-                for doc_name in source_documents:
-                    if source_name in doc_name or doc_name in source_name:
-                        images.append(img_data)
-                        break
-            
-            return images[:3]  # Top 3 images only
-            
+            self._reload_image_index()
         except Exception as e:
             print(f"⚠️ Could not load image metadata: {e}")
             return []
+        
+        images = []
+        for source_name, doc_images in self._images_by_doc.items():
+            # Same loose match as before grouping - either name may contain the other
+            if any(source_name in doc_name or doc_name in source_name for doc_name in source_documents):
+                images.extend(doc_images)
+                
+                # Top 3 images only
+                if len(images) >= 3:
+                    break
+        
+        return images[:3]
     
     def chat(self):
         """Interactive chat mode"""
-        if not self.query_engine:
+        if not self.streaming_query_engine:
             print("❌ No index available. Please run document_ingestion.py first.")
             return
         
@@ -311,9 +642,13 @@ class QueryEngine:
                     print("\n👋 Goodbye!")
                     break
                 
-                result = self.query(question)
+                result = self.query_stream(question)
                 
-                print(f"\n🤖 Assistant: {result['response']}\n")
+                # Print the answer as Gemini generates it
+                print("\n🤖 Assistant: ", end="", flush=True)
+                for delta in result['response_gen']:
+                    print(delta, end="", flush=True)
+                print("\n")
                 
                 if result['sources']:
                     print("📚 Sources:")
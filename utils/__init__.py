@@ -1,33 +1,60 @@
 """
 Utility modules for NASA Research Assistant
+
+Submodules are imported on first use (PEP 562), so code that only needs
+e.g. utils.rate_limit doesn't pull in Streamlit.
 """
+import importlib
+
+# Make imports easier - public name -> submodule that defines it
+_SUBMODULE_EXPORTS = {
+    '.ui_components': [
+        'setup_page_config',
+        'apply_dark_theme',
+        'validate_url',
+        'show_nasa_logo',
+        'render_header',
+    ],
+    '.session_manager': [
+        'initialize_session_state',
+        'clear_chat_history',
+        'add_message',
+        'add_messages',
+    ],
+    '.document_manager': [
+        'get_file_hash',
+        'get_file_quick_key',
+        'stream_to_disk_and_hash',
+        'load_document_metadata',
+        'save_document_metadata',
+        'add_document_to_metadata',
+        'metadata_batch',
+        'get_document_url',
+        'get_document_url_map',
+        'is_document_indexed',
+        'is_hash_indexed',
+        'matches_recorded_document',
+    ],
+    '.rate_limit': [
+        'is_quota_error',
+        'RateLimiter',
+    ],
+    '.chat_handler': [
+        'response_lacks_info',
+        'available_images',
+        'image_caption',
+        'reset_image_cache',
+        'display_chat_message',
+        'display_chat_history',
+        'get_chat_input',
+    ],
+}
 
-# Make imports easier
-from .ui_components import (
-    setup_page_config, 
-    apply_dark_theme, 
-    validate_url, 
-    show_nasa_logo,
-    render_header
-)
-from .session_manager import (
-    initialize_session_state,
-    clear_chat_history,
-    add_message
-)
-from .document_manager import (
-    get_file_hash, 
-    load_document_metadata, 
-    save_document_metadata,
-    add_document_to_metadata,
-    get_document_url,
-    is_document_indexed
-)
-from .chat_handler import (
-    display_chat_message,
-    display_chat_history,
-    get_chat_input
-)
+_NAME_TO_SUBMODULE = {
+    name: submodule
+    for submodule, names in _SUBMODULE_EXPORTS.items()
+    for name in names
+}
 
 __all__ = [
     # UI Components
@@ -36,23 +63,52 @@ __all__ = [
     'validate_url',
     'show_nasa_logo',
     'render_header',
-    
+
     # Session Management
     'initialize_session_state',
     'clear_chat_history',
     'add_message',
-    
+    'add_messages',
+
     # Document Management
     'get_file_hash',
+    'get_file_quick_key',
+    'stream_to_disk_and_hash',
     'load_document_metadata',
     'save_document_metadata',
     'add_document_to_metadata',
+    'metadata_batch',
     'get_document_url',
+    'get_document_url_map',
     'is_document_indexed',
-    
+    'is_hash_indexed',
+    'matches_recorded_document',
+
+    # Rate Limiting
+    'is_quota_error',
+    'RateLimiter',
+
     # Chat Handler
+    'response_lacks_info',
+    'available_images',
+    'image_caption',
+    'reset_image_cache',
     'display_chat_message',
     'display_chat_history',
     'get_chat_input',
 ]
 
+
+def __getattr__(name):
+    """Import the submodule that defines name on first access"""
+    submodule = _NAME_TO_SUBMODULE.get(name)
+    if submodule is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(submodule, __name__), name)
+    globals()[name] = value  # Later lookups are a plain module dict hit
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -2,9 +2,99 @@
 Chat Handler for NASA Research Assistant
 Manages chat display, source citations, and image rendering
 """
+import os
+import re
+from collections import OrderedDict
 import streamlit as st
-from pathlib import Path
-from utils.document_manager import load_document_metadata
+from utils.document_manager import get_document_url_map
+
+
+# Phrases the assistant uses when the papers don't cover a question
+NO_INFO_PHRASES = [
+    "don't have specific information",
+    "don't have information",
+    "no information available",
+    "not available in",
+    "cannot find"
+]
+
+# Compiled once at import - matches every phrase in a single case-insensitive pass
+_NO_INFO_RE = re.compile("|".join(map(re.escape, NO_INFO_PHRASES)), re.IGNORECASE)
+
+# Image existence checks remembered per session (least recently used dropped beyond this)
+IMAGE_CACHE_SIZE = 512
+
+
+def response_lacks_info(content):
+    """
+    Check if a response says the documents don't have the answer
+    
+    Args:
+        content: The assistant's response text
+        
+    Returns:
+        True if any "no information" phrase appears in the response
+    """
+    return _NO_INFO_RE.search(content) is not None
+
+
+def _session_image_cache():
+    """This session's path -> exists LRU (created on first use)"""
+    cache = st.session_state.get("image_ok_cache")
+    if cache is None:
+        cache = st.session_state.image_ok_cache = OrderedDict()
+    return cache
+
+
+def _image_ok(path_str):
+    """Whether an image file exists (cached - chat history replays the same paths every rerun)"""
+    cache = _session_image_cache()
+    exists = cache.get(path_str)
+    if exists is not None:
+        cache.move_to_end(path_str)
+        return exists
+    
+    exists = os.path.isfile(path_str)
+    cache[path_str] = exists
+    if len(cache) > IMAGE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return exists
+
+
+def reset_image_cache():
+    """Forget this session's image checks (other sessions keep theirs)"""
+    st.session_state.image_ok_cache = OrderedDict()
+
+
+def available_images(images):
+    """
+    Filter images down to the ones that exist on disk
+    
+    Args:
+        images: List of image metadata dicts
+        
+    Returns:
+        The images whose files exist, in their original order
+    """
+    return [img for img in images if _image_ok(img["path"])]
+
+
+def image_caption(img_data):
+    """
+    Build the caption shown under an image (source PDF and page)
+    
+    Args:
+        img_data: Image metadata dict
+        
+    Returns:
+        Caption string (empty if there's no source info)
+    """
+    caption_parts = []
+    if "source_pdf" in img_data:
+        caption_parts.append(f"📄 {img_data['source_pdf']}")
+    if "page" in img_data:
+        caption_parts.append(f"Page {img_data['page']}")
+    return " • ".join(caption_parts)
 
 
 def display_chat_message(message):
@@ -37,24 +127,18 @@ def _display_images(message):
     
     st.markdown("")  # Add some spacing
     
-    for img_data in message["images"]:
+    for img_data in available_images(message["images"]):
         try:
-            img_path = Path(img_data["path"])
-            if not img_path.exists():
-                continue
-            
             # Show the image
-            st.image(str(img_path), use_column_width=True)
+            st.image(img_data["path"], use_column_width=True)
             
-            # Add caption with source info
-            caption_parts = []
-            if "source_pdf" in img_data:
-                caption_parts.append(f"📄 {img_data['source_pdf']}")
-            if "page" in img_data:
-                caption_parts.append(f"Page {img_data['page']}")
+            # Add caption with source info (precomputed when the message was added)
+            caption = img_data.get("caption")
+            if caption is None:
+                caption = image_caption(img_data)
             
-            if caption_parts:
-                st.caption(" • ".join(caption_parts))
+            if caption:
+                st.caption(caption)
             
             # Show image description if available
             if "description" in img_data and img_data["description"]:
@@ -75,41 +159,23 @@ def _display_sources(message, content):
     relevant_sources = message["sources"]
     
     # Don't show sources if the assistant says they don't have info
-    no_info_phrases = [
-        "don't have specific information",
-        "don't have information",
-        "no information available",
-        "not available in",
-        "cannot find"
-    ]
-    
-    has_no_info = any(phrase in content.lower() for phrase in no_info_phrases)
-    
-    if not relevant_sources or has_no_info:
+    if not relevant_sources or response_lacks_info(content):
         return
     
     # Display sources section
     st.markdown("---")
     st.caption("**📚 Sources:**")
     
-    metadata = load_document_metadata()
+    url_map = get_document_url_map()
     
-    # Get unique source documents
-    unique_sources = {}
-    for source in relevant_sources:
-        filename = source['metadata'].get('file_name', 'Unknown')
-        if filename not in unique_sources:
-            unique_sources[filename] = True
+    # Get unique source documents (in first-seen order)
+    unique_sources = list(dict.fromkeys(
+        source['metadata'].get('file_name', 'Unknown') for source in relevant_sources
+    ))
     
     # Show each source with link if available, numbered like [1], [2], etc.
-    for idx, filename in enumerate(unique_sources.keys(), 1):
-        doc_url = None
-        
-        # Find the URL for this document
-        for hash_val, meta in metadata.items():
-            if meta.get('filename') == filename:
-                doc_url = meta.get('url')
-                break
+    for idx, filename in enumerate(unique_sources, 1):
+        doc_url = url_map.get(filename)
         
         # Display with numbered citation and clickable link (just the URL)
         if doc_url:
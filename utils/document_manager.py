@@ -2,45 +2,200 @@
 Document Manager for NASA Research Assistant
 Handles document uploads, metadata, and file operations
 """
-import hashlib
+import os
+import re
 import json
+import hashlib
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
+from types import MappingProxyType
+import blake3
 import config
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+# Store metadata in project root so it's tracked by Git (not in data/)
+METADATA_FILE = Path(".document_metadata.json")
+_META_PATH = str(METADATA_FILE)  # Plain string for the per-call stat and read
+
+# Entries ingested before the switch to BLAKE3 are keyed by MD5 (32 hex chars, BLAKE3 has 64)
+_LEGACY_KEY_RE = re.compile(r'[0-9a-f]{32}')
+
+# Bytes hashed for the (size, prefix hash) quick-reject key
+PREFIX_BYTES = 64 * 1024
+
+# (mtime_ns, read-only metadata) of the last load - the file is only parsed again when it changes
+_META_CACHE = None
+_URL_MAP_CACHE = None  # (mtime_ns, filename -> URL), built from the same file version
+
+# (mtime_ns, {(size, prefix_hash)}, has entries without a quick key)
+_QUICK_KEY_CACHE = None
 
-def get_file_hash(file_content):
+# Metadata dict of the metadata_batch() open in this thread, if any
+_batch_state = threading.local()
+_METADATA_LOCK = threading.Lock()
+
+
+def get_file_hash(file_content, chunk=1 << 20):
     """
     Calculate a unique hash for a file to detect duplicates
     
     Args:
-        file_content: The file bytes
+        file_content: The file bytes, or a file-like object (e.g. a Streamlit
+            UploadedFile) - read a chunk at a time, so it's never copied whole
+        chunk: Read size in bytes for file-like objects (1MB by default)
         
     Returns:
-        MD5 hash string
+        BLAKE3 hash string
     """
-    return hashlib.md5(file_content).hexdigest()
+    # BLAKE3 is SIMD-accelerated and multithreaded, so large PDFs hash quickly
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        hasher.update(file_content)
+        return hasher.hexdigest()
+    
+    file_content.seek(0)
+    while chunk_bytes := file_content.read(chunk):
+        hasher.update(chunk_bytes)
+    file_content.seek(0)
+    return hasher.hexdigest()
 
 
-def load_document_metadata():
+def get_file_quick_key(file_content):
     """
-    Load the metadata file that stores info about uploaded documents
+    Cheap fingerprint of a file: its size and a hash of its first PREFIX_BYTES
+    
+    Files with different quick keys can't be identical, so a novel upload is
+    recognised without reading (or fully hashing) the rest of it.
+    
+    Args:
+        file_content: The file bytes, or a file-like object (left rewound)
+        
+    Returns:
+        (size, prefix_hash) tuple
+    """
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        return len(file_content), blake3.blake3(file_content[:PREFIX_BYTES]).hexdigest()
+    
+    size = file_content.seek(0, os.SEEK_END)
+    file_content.seek(0)
+    prefix_hash = blake3.blake3(file_content.read(PREFIX_BYTES)).hexdigest()
+    file_content.seek(0)
+    return size, prefix_hash
+
+
+def stream_to_disk_and_hash(upload, dest_path, chunk=1 << 20):
+    """
+    Copy an uploaded file to disk and hash it in one pass, a chunk at a time
     
+    Args:
+        upload: File-like object (e.g. a Streamlit UploadedFile)
+        dest_path: Where to write the file
+        chunk: Read size in bytes (1MB by default)
+        
     Returns:
-        Dictionary with document metadata (filename, URL, upload date, etc.)
+        BLAKE3 hash string (same value as get_file_hash on the whole file)
     """
-    # Store metadata in project root so it's tracked by Git (not in data/)
-    metadata_file = Path(".document_metadata.json")
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    upload.seek(0)
+    
+    with open(dest_path, 'wb') as f:
+        while chunk_bytes := upload.read(chunk):
+            hasher.update(chunk_bytes)
+            f.write(chunk_bytes)
     
+    return hasher.hexdigest()
+
+
+def _metadata_mtime():
+    """Modification time of the metadata file, or None if it doesn't exist yet"""
     try:
-        if metadata_file.exists():
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        return os.stat(_META_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_document_metadata(mtime):
+    """Parse the metadata file into read-only mappings (shared by every caller)"""
+    metadata = {}
+    try:
+        if mtime is not None:
+            with open(_META_PATH, 'rb') as f:
+                data = f.read()
+            metadata = orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
     except Exception as e:
         # If we can't load it, just return empty dict
         print(f"Warning: Could not load document metadata: {e}")
     
-    return {}
+    return MappingProxyType({
+        file_hash: MappingProxyType(doc_info) for file_hash, doc_info in metadata.items()
+    })
+
+
+def _editable_copy(metadata):
+    """Plain, modifiable copy of the metadata (entries included)"""
+    return {file_hash: dict(doc_info) for file_hash, doc_info in metadata.items()}
+
+
+def load_document_metadata():
+    """
+    Load the metadata file that stores info about uploaded documents
+    
+    The parsed file is cached and only re-read when it changes on disk,
+    so calling this on every Streamlit rerun is cheap.
+    
+    The result is shared, so it's read-only - use metadata_batch or
+    add_document_to_metadata to change it.
+    
+    Returns:
+        Read-only mapping with document metadata (filename, URL, upload date, etc.)
+    """
+    global _META_CACHE
+    mtime = _metadata_mtime()  # One stat per call
+    cached = _META_CACHE
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
+    metadata = _read_document_metadata(mtime)
+    _META_CACHE = (mtime, metadata)
+    return metadata
+
+
+def _build_document_url_map():
+    """Invert the metadata into filename -> URL"""
+    url_map = {}
+    for doc_info in load_document_metadata().values():
+        if 'filename' in doc_info:
+            # First entry wins, matching the old linear search
+            url_map.setdefault(doc_info['filename'], doc_info.get('url'))
+    return url_map
+
+
+def get_document_url_map():
+    """
+    Get a filename -> URL lookup for all indexed documents
+    
+    Built once per version of the metadata file, so every source lookup is O(1).
+    
+    Returns:
+        Dictionary mapping each document filename to its URL
+    """
+    global _URL_MAP_CACHE
+    mtime = _metadata_mtime()
+    cached = _URL_MAP_CACHE
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
+    url_map = _build_document_url_map()
+    _URL_MAP_CACHE = (mtime, url_map)
+    return url_map
 
 
 def save_document_metadata(metadata_dict):
@@ -48,19 +203,61 @@ def save_document_metadata(metadata_dict):
     Save document metadata to disk
     
     Args:
-        metadata_dict: The metadata dictionary to save
+        metadata_dict: The metadata dictionary to save (a load_document_metadata() result works too)
     """
-    # Store metadata in project root so it's tracked by Git (not in data/)
-    metadata_file = Path(".document_metadata.json")
+    metadata_dict = _editable_copy(metadata_dict)  # Read-only mappings aren't JSON serializable
+    if ORJSON_AVAILABLE:
+        data = orjson.dumps(metadata_dict, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(metadata_dict, indent=2).encode('utf-8')
     
     try:
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata_dict, f, indent=2)
+        # Write a temp file and swap it in, so a crash never leaves half a file
+        temp_file = METADATA_FILE.with_suffix('.json.tmp')
+        temp_file.write_bytes(data)
+        os.replace(temp_file, METADATA_FILE)
     except Exception as e:
         print(f"Error saving document metadata: {e}")
+    
+    # Don't trust mtime alone - two writes can land within the same tick
+    global _META_CACHE, _URL_MAP_CACHE, _QUICK_KEY_CACHE
+    _META_CACHE = None
+    _URL_MAP_CACHE = None
+    _QUICK_KEY_CACHE = None
+
+
+@contextmanager
+def metadata_batch():
+    """
+    Group several metadata changes into a single load and save
+    
+    add_document_to_metadata calls made inside the block (in this thread)
+    update the batch instead of rewriting the file each time. The yielded
+    dict is a private copy, so entries can be changed in place. Nested batches
+    join the outer one; batches in other threads wait for this one to finish.
+    
+    Yields:
+        The metadata dictionary, saved once when the block exits cleanly
+    """
+    if getattr(_batch_state, "metadata", None) is not None:
+        yield _batch_state.metadata
+        return
+    
+    # Held from load to save, so overlapping batches can't drop each other's entries
+    with _METADATA_LOCK:
+        original = _editable_copy(load_document_metadata())
+        metadata = _editable_copy(original)
+        _batch_state.metadata = metadata
+        try:
+            yield metadata
+        finally:
+            _batch_state.metadata = None
+        
+        if metadata != original:
+            save_document_metadata(metadata)
 
 
-def add_document_to_metadata(file_hash, filename, url):
+def add_document_to_metadata(file_hash, filename, url, quick_key=None):
     """
     Add a new document to the metadata store
     
@@ -68,24 +265,26 @@ def add_document_to_metadata(file_hash, filename, url):
         file_hash: Unique hash of the file
         filename: Name of the file
         url: URL where the document can be found
+        quick_key: Optional (size, prefix_hash) from get_file_quick_key, stored so
+            is_document_indexed can reject new files without a full hash
         
     Returns:
         True if added, False if already exists
     """
-    metadata = load_document_metadata()
-    
-    # Check if this file already exists
-    if file_hash in metadata:
-        return False
-    
-    # Add the new document
-    metadata[file_hash] = {
-        "filename": filename,
-        "url": url,
-        "ingested_at": datetime.now().isoformat()
-    }
+    with metadata_batch() as metadata:
+        # Check if this file already exists
+        if file_hash in metadata:
+            return False
+        
+        # Add the new document
+        metadata[file_hash] = {
+            "filename": filename,
+            "url": url,
+            "ingested_at": datetime.now().isoformat()
+        }
+        if quick_key is not None:
+            metadata[file_hash]["size"], metadata[file_hash]["prefix_hash"] = quick_key
     
-    save_document_metadata(metadata)
     return True
 
 
@@ -99,27 +298,176 @@ def get_document_url(filename):
     Returns:
         URL string or None if not found
     """
-    metadata = load_document_metadata()
+    return get_document_url_map().get(filename)
+
+
+def _indexed_quick_keys():
+    """Quick keys of all indexed documents, and whether any entry still has none"""
+    global _QUICK_KEY_CACHE
+    mtime = _metadata_mtime()
+    cached = _QUICK_KEY_CACHE
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
     
-    # Search through all documents
+    metadata = load_document_metadata()
+    quick_keys = set()
+    missing = []
     for file_hash, doc_info in metadata.items():
-        if doc_info.get('filename') == filename:
-            return doc_info.get('url')
+        if "size" in doc_info and "prefix_hash" in doc_info:
+            quick_keys.add((doc_info["size"], doc_info["prefix_hash"]))
+        else:
+            missing.append(file_hash)
+    
+    if missing:
+        backfilled = _backfill_quick_keys(metadata, missing)
+        quick_keys.update(backfilled.values())
+        has_unkeyed = len(backfilled) < len(missing)
+    else:
+        has_unkeyed = False
     
-    return None
+    _QUICK_KEY_CACHE = (_metadata_mtime(), quick_keys, has_unkeyed)
+    return quick_keys, has_unkeyed
+
+
+def _backfill_quick_keys(metadata, file_hashes):
+    """
+    Record quick keys for entries ingested before they were stored
+    
+    Uses the copy of each document kept in the data folder, but only when its
+    full hash still matches the entry. Documents no longer on disk keep going
+    through the full-hash check.
+    
+    Returns:
+        Dictionary of file_hash -> (size, prefix_hash) for the entries filled in
+    """
+    backfilled = {}
+    for file_hash in file_hashes:
+        path = Path(config.DATA_DIR) / metadata[file_hash].get("filename", "")
+        if not path.is_file():
+            continue
+        
+        try:
+            with open(path, 'rb') as f:
+                on_disk_hash = _md5_of(f) if _LEGACY_KEY_RE.fullmatch(file_hash) else get_file_hash(f)
+                if on_disk_hash == file_hash:
+                    backfilled[file_hash] = get_file_quick_key(f)
+        except OSError:
+            continue
+    
+    if backfilled:
+        with metadata_batch() as batch:
+            for file_hash, (size, prefix_hash) in backfilled.items():
+                if file_hash in batch:
+                    batch[file_hash] = {**batch[file_hash], "size": size, "prefix_hash": prefix_hash}
+    return backfilled
+
+
+def _quick_reject(quick_key):
+    """True if no indexed document can match this (size, prefix_hash) key"""
+    quick_keys, has_unkeyed = _indexed_quick_keys()
+    return not has_unkeyed and quick_key not in quick_keys
 
 
 def is_document_indexed(file_content):
     """
     Check if a document has already been indexed
     
+    The file's size and first PREFIX_BYTES are checked first - when no indexed
+    document matches them, the rest of the file is never read.
+    
     Args:
-        file_content: The file bytes
+        file_content: The file bytes, or the uploaded file itself (no need to .read() it first)
         
     Returns:
         True if already indexed, False if new
     """
-    file_hash = get_file_hash(file_content)
-    metadata = load_document_metadata()
-    return file_hash in metadata
+    if _quick_reject(get_file_quick_key(file_content)):
+        return False
+    
+    return is_hash_indexed(get_file_hash(file_content), file_content)
+
+
+def is_hash_indexed(file_hash, file_content=None, quick_key=None):
+    """
+    Check if a document with this file hash has already been indexed
+    
+    Args:
+        file_hash: Hash from get_file_hash / stream_to_disk_and_hash
+        file_content: Optional file bytes, file-like object or path - lets
+            documents recorded under their old MD5 key be recognised (and re-keyed)
+        quick_key: Optional (size, prefix_hash) from get_file_quick_key - a
+            file no indexed document matches is reported new straight away
+        
+    Returns:
+        True if already indexed, False if new
+    """
+    if quick_key is not None and _quick_reject(tuple(quick_key)):
+        return False
+    if file_hash in load_document_metadata():
+        return True
+    return file_content is not None and _adopt_legacy_entry(file_hash, file_content)
+
+
+def matches_recorded_document(file_path):
+    """
+    Check whether a file is the document recorded under its filename
+    
+    Compares the file's hash with the metadata entries for that name - the
+    BLAKE3 key, or the MD5 key of entries ingested before BLAKE3.
+    
+    Args:
+        file_path: Path of the file on disk
+        
+    Returns:
+        True if an entry with this filename has this file's content
+    """
+    name = Path(file_path).name
+    keys = {key for key, doc_info in load_document_metadata().items() if doc_info.get("filename") == name}
+    if not keys:
+        return False
+    
+    with open(file_path, 'rb') as f:
+        if any(_LEGACY_KEY_RE.fullmatch(key) for key in keys) and _md5_of(f) in keys:
+            return True
+        return get_file_hash(f) in keys
+
+
+def _md5_of(file_content, chunk=1 << 20):
+    """MD5 hex digest of bytes, a file-like object (left rewound) or a file path"""
+    if isinstance(file_content, (bytes, bytearray, memoryview)):
+        return hashlib.md5(file_content).hexdigest()
+    
+    if isinstance(file_content, (str, os.PathLike)):
+        with open(file_content, 'rb') as f:
+            return _md5_of(f, chunk)
+    
+    hasher = hashlib.md5()
+    file_content.seek(0)
+    while chunk_bytes := file_content.read(chunk):
+        hasher.update(chunk_bytes)
+    file_content.seek(0)
+    return hasher.hexdigest()
+
+
+def _adopt_legacy_entry(file_hash, file_content):
+    """
+    Re-key a document recorded under its pre-BLAKE3 MD5 hash
+    
+    Only runs (and only reads the file) while MD5-keyed entries remain.
+    
+    Returns:
+        True if the file matched a legacy entry (now stored under file_hash)
+    """
+    legacy_keys = {key for key in load_document_metadata() if _LEGACY_KEY_RE.fullmatch(key)}
+    if not legacy_keys:
+        return False
+    
+    md5_hash = _md5_of(file_content)
+    if md5_hash not in legacy_keys:
+        return False
+    
+    with metadata_batch() as metadata:
+        if md5_hash in metadata:
+            metadata[file_hash] = metadata.pop(md5_hash)
+    return True
 
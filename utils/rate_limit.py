@@ -0,0 +1,53 @@
+"""
+Rate Limit Helpers for NASA Research Assistant
+Detects Gemini quota / rate limit errors so callers can back off or fall back,
+and spaces out API calls made from several threads
+"""
+import re
+import time
+import threading
+
+
+# Quota / rate limit indicators in one pattern - a single pass over the message, no lowercased copy
+_QUOTA_RE = re.compile(
+    r"quota|rate[ _-]?limit|resource[ _]exhausted|429|too many requests|limit exceeded",
+    re.IGNORECASE
+)
+
+
+def is_quota_error(error):
+    """
+    Check if an error is related to quota/rate limiting
+
+    Args:
+        error: The exception raised by an API call
+
+    Returns:
+        True if retrying later (or on another model) could succeed
+    """
+    return _QUOTA_RE.search(str(error)) is not None
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at most `rate` per second"""
+    
+    def __init__(self, rate: float):
+        """Initialize the limiter
+        
+        Args:
+            rate: Maximum calls per second (across all threads)
+        """
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+    
+    def wait(self):
+        """Block until the caller may make its next call"""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        
+        # Sleep outside the lock - only the residual time, not a fixed pause
+        if delay > 0:
+            time.sleep(delay)
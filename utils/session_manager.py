@@ -3,6 +3,7 @@ Session State Manager for NASA Research Assistant
 Keeps track of chat history, uploads, and user state
 """
 import streamlit as st
+from utils.chat_handler import image_caption, reset_image_cache
 
 
 def initialize_session_state():
@@ -26,6 +27,12 @@ def initialize_session_state():
     if 'show_welcome' not in st.session_state:
         st.session_state.show_welcome = True
     
+    # Background ingestion jobs (file hash -> Future / progress dict)
+    if 'ingest_futures' not in st.session_state:
+        st.session_state.ingest_futures = {}
+    if 'ingest_progress' not in st.session_state:
+        st.session_state.ingest_progress = {}
+    
     # Track which AI model we're currently using (for fallback handling)
     if 'current_model_index' not in st.session_state:
         st.session_state.current_model_index = 0
@@ -35,18 +42,11 @@ def clear_chat_history():
     """Wipe the chat history and start fresh"""
     st.session_state.messages = []
     st.session_state.query_count = 0
+    reset_image_cache()
 
 
-def add_message(role, content, sources=None, images=None):
-    """
-    Add a message to the chat history
-    
-    Args:
-        role: 'user' or 'assistant'
-        content: The message text
-        sources: List of source documents (optional)
-        images: List of relevant images (optional)
-    """
+def _build_message(role, content, sources=None, images=None):
+    """Message dict as stored in the chat history"""
     message = {
         "role": role,
         "content": content,
@@ -56,9 +56,40 @@ def add_message(role, content, sources=None, images=None):
     if sources is not None:
         message["sources"] = sources
     
-    # Add images if provided
+    # Add images if provided, with captions built once here instead of on every rerun
     if images is not None:
-        message["images"] = images
+        message["images"] = [
+            {**img, "caption": image_caption(img)} if "caption" not in img else img
+            for img in images
+        ]
     
-    st.session_state.messages.append(message)
+    return message
+
 
+def add_message(role, content, sources=None, images=None):
+    """
+    Add a message to the chat history
+    
+    Args:
+        role: 'user' or 'assistant'
+        content: The message text
+        sources: List of source documents (optional)
+        images: List of relevant images (optional)
+    """
+    st.session_state.messages.append(_build_message(role, content, sources, images))
+
+
+def add_messages(batch):
+    """
+    Add several messages to the chat history at once (e.g. replaying a conversation)
+    
+    Goes through Streamlit's session state proxy once instead of once per message.
+    
+    Args:
+        batch: Iterable of (role, content, sources, images) tuples - sources and
+            images may be None, like the add_message arguments
+    """
+    st.session_state.messages.extend(
+        _build_message(role, content, sources, images)
+        for role, content, sources, images in batch
+    )
@@ -2,10 +2,16 @@
 UI Components for NASA Research Assistant
 Handles styling, themes, and visual elements
 """
+import re
 import streamlit as st
+from functools import lru_cache
 from pathlib import Path
 
 
+# Leading whitespace allowed, like the stripped check it replaces
+_URL_RE = re.compile(r'\s*https?://', re.IGNORECASE)
+
+
 def setup_page_config():
     """Set up the page - title, icon, layout, etc."""
     st.set_page_config(
@@ -21,9 +27,8 @@ def setup_page_config():
     )
 
 
-def apply_dark_theme():
-    """Apply the NASA-inspired dark theme to the app"""
-    st.markdown("""
+# NASA-inspired dark theme (built once at import)
+_DARK_CSS = """
 <style>
     /* Dark background */
     .stApp {
@@ -221,15 +226,34 @@ def apply_dark_theme():
         color: #ffffff;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+def apply_dark_theme():
+    """Apply the NASA-inspired dark theme to the app"""
+    # Sent on every rerun on purpose - Streamlit drops elements a rerun doesn't re-emit
+    st.markdown(_DARK_CSS, unsafe_allow_html=True)
+
+
+@lru_cache(maxsize=1)
+def _load_logo_bytes(logo_path="assets/nasa_logo.png"):
+    """Read the logo file once per process (None if it's missing)
+    
+    The asset ships with the app, so the "missing" verdict is cached too.
+    """
+    logo_path = Path(logo_path)
+    if not logo_path.exists():
+        return None
+    return logo_path.read_bytes()
 
 
 def show_nasa_logo():
     """Display the NASA logo in the sidebar, or a rocket emoji as fallback"""
     try:
-        logo_path = Path("assets/nasa_logo.png")
-        if logo_path.exists():
-            st.image(str(logo_path), width=150)
+        # Cached bytes - no stat or disk read for the logo on every rerun
+        logo_bytes = _load_logo_bytes()
+        if logo_bytes:
+            st.image(logo_bytes, width=150)
         else:
             # If logo file doesn't exist, show emoji
             st.markdown("# 🚀")
@@ -254,8 +278,5 @@ def validate_url(url):
     Returns:
         True if valid, False otherwise
     """
-    if not url:
-        return False
-    url = url.strip()
-    return url.startswith(('http://', 'https://'))
+    return bool(url) and _URL_RE.match(url) is not None
 